@@ -0,0 +1,86 @@
+import threading
+from time import perf_counter_ns, sleep
+import paho.mqtt.client as mqtt
+from Faderport.transport import MQTTTransport, LocalTransport, LocalClient, LOCAL_PATH_DEFAULT
+
+"""
+Benchmark one-way latency of topic/payload messages from the bridge to a consumer on the same machine,
+through a MQTT broker on localhost compared to broker-less LocalTransport.
+Not part of the package, run from the repository with the package installed or on the path:
+python benchmarks/benchmark_transport.py
+"""
+TOPIC = "faderport/col1_slider/event/pitch"
+
+
+def benchmark(transport, consumer, connect, count: int, interval: float) -> list:
+    """
+    Publish count messages with a timestamp as payload and measure latency at the consumer.
+    :return: list of latencies in microseconds.
+    """
+    latencies = []
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        latencies.append((perf_counter_ns() - int(msg.payload)) / 1000)
+        if len(latencies) >= count:
+            done.set()
+
+    transport.start()
+    consumer.on_message = on_message
+    connect()
+    consumer.subscribe(TOPIC)
+    consumer.loop_start()
+    # Let subscription settle
+    sleep(0.5)
+    for i in range(count):
+        transport.publish(TOPIC, f"{perf_counter_ns()}")
+        sleep(interval)
+    done.wait(timeout=5.0)
+    consumer.loop_stop()
+    transport.stop()
+    return latencies
+
+
+def print_latencies(name: str, latencies: list, count: int):
+    if not latencies:
+        print(f"{name:<8} no messages received")
+        return
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    median = latencies[len(latencies) // 2]
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(f"{name:<8} received {len(latencies)}/{count} mean {mean:.1f} us, median {median:.1f} us, "
+          f"p99 {p99:.1f} us, max {latencies[-1]:.1f} us")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', '-n',
+                        type=int, default=2000,
+                        help="Number of messages. Default: 2000")
+    parser.add_argument('--interval', '-i',
+                        type=float, default=0.001,
+                        help="Seconds between messages. Default: 0.001")
+    parser.add_argument('--host',
+                        type=str, default="127.0.0.1",
+                        help="MQTT broker. Default: 127.0.0.1")
+    parser.add_argument('--path',
+                        type=str, default=LOCAL_PATH_DEFAULT,
+                        help=f"Unix domain socket for LocalTransport. Default: {LOCAL_PATH_DEFAULT}")
+    args = parser.parse_args()
+
+    mqtt_consumer = mqtt.Client()
+    try:
+        mqtt_latencies = benchmark(MQTTTransport(host=args.host), mqtt_consumer,
+                                   lambda: mqtt_consumer.connect(host=args.host),
+                                   args.count, args.interval)
+        print_latencies("MQTT", mqtt_latencies, args.count)
+    except OSError as ex:
+        print(f"MQTT     skipped, couldn't connect to broker {args.host}: {ex}")
+
+    local_consumer = LocalClient()
+    local_latencies = benchmark(LocalTransport(path=args.path), local_consumer,
+                                lambda: local_consumer.connect(path=args.path),
+                                args.count, args.interval)
+    print_latencies("Local", local_latencies, args.count)
@@ -1,43 +1,74 @@
 import platform
 import threading
-from time import sleep
+from time import sleep, monotonic
 import re
 import mido  # https://github.com/mido/mido, also run pip3 install python-rtmidi --install-option="--no-jack"
-import paho.mqtt.client as mqtt
 from Faderport.constants import *
 from Faderport.structure import FaderportControlsMidi2MQTT, Button
+from Faderport.taper import FaderTaper, TAPERS
+from Faderport.hooks import DispatchHooks
+from Faderport.animation import LightEngine
+from Faderport.rules import FeedbackRules
+from Faderport.transport import Transport, MQTTTransport, LocalTransport, LOCAL_PATH_DEFAULT
+from Faderport.events import EventBus, Subscription
+from Faderport.identity import DeviceIdentity, IdentityCache, IDENTITY_REQUEST, IDENTITY_CACHE_DEFAULT
+
+"""
+Controls layout per model name, unknown models use the Faderport 8 layout.
+"""
+LAYOUTS = {
+    "FP8": FaderportControlsMidi2MQTT,
+}
 
 
 class Faderport(threading.Thread):
     def __init__(self, port_user_in: str = "", port_user_out: str = "",
-                 print_midi: bool = False, test_mode: bool = False):
+                 print_midi: bool = False, test_mode: bool = False,
+                 taper: FaderTaper = None, profiling_path: str = "",
+                 transport: Transport = None, rules_path: str = "",
+                 identity_cache_path: str = IDENTITY_CACHE_DEFAULT, probe: bool = False):
         """
         Init a Faderport object and prepare MIDI-connections.
-        :type test_mode: Test-mode write control-values back so buttons light up.
+        :type test_mode: Test-mode write control-values back so buttons light up, a momentary feedback rule.
         :type print_midi: Shows MIDI-messages in the console.
         :type port_user: Set MIDI IO-port for Faderport8 Port User.
                          Port is found via a regex search of available ports.
                          Usually: PreSonus FP8:PreSonus FP8 MIDI 1 16:0
+        :type taper: Fader taper shared by all sliders for event/normalized, event/db, set_normalized and set_db.
+                     Defaults to an audio taper, set slider.taper to change a single slider.
+        :type profiling_path: File to append profiling reports to, published on faderport/profiling/report if empty.
+        :type transport: Transport for topics and payloads, defaults to MQTTTransport on 127.0.0.1.
+                         Use LocalTransport for broker-less consumers on the same machine.
+        :type rules_path: JSON file with local feedback rules, see Faderport/rules.py.
+        :type identity_cache_path: JSON file caching port names and device identity, caching is disabled if empty.
+        :type probe: Probe device identity even if it's cached.
         """
         # Flags
         self.print_midi = print_midi
         self.test_mode = test_mode
+        self.taper = taper
 
-        # Find port names
-        self._ports_midi_in = mido.get_input_names()
-        self._ports_midi_out = mido.get_output_names()
-        if platform.system() == "Windows":
-            self.port_user_in = self._find_port(port_user_in, "PreSonus.*0", direction_in=True)
-            self.port_user_out = self._find_port(port_user_out, "PreSonus.*1", direction_in=False)
-        else:
-            self.port_user_in = self._find_port(port_user_in, "PreSonus.*FP8", direction_in=True)
-            self.port_user_out = self._find_port(port_user_out, "PreSonus.*FP8", direction_in=False)
+        # Find port names, cached names skip enumeration of ports
+        self.identity_cache = IdentityCache(path=identity_cache_path)
+        self.probe = probe
+        self._ports_midi_in = None
+        self._ports_midi_out = None
+        self._port_user_in_search = port_user_in
+        self._port_user_out_search = port_user_out
+        self._find_ports()
 
         # Instantiate variables
         self.midi_user_in = None
         self.midi_user_out = None
-        self.mqtt_client = None
+        self.transport = transport
         self.controls = None
+        self.events = EventBus(faderport=self)
+        self.hooks = DispatchHooks(faderport=self, report_path=profiling_path)
+        self.lights = LightEngine(faderport=self)
+        self.rules = FeedbackRules(faderport=self, path=rules_path, test_mode=test_mode)
+        self.identity = None
+        self.sysex_prefix = SYSEX_PREFIX_FADERPORT
+        self.sysex_handlers = []
         threading.Thread.__init__(self)
         self.setDaemon(True)
         self.quit = False
@@ -51,6 +82,9 @@ class Faderport(threading.Thread):
             midi_id = msg.note
         elif msg.type == 'pitchwheel':
             midi_id = 'pitchwheel'
+        elif msg.type == 'sysex':
+            self.sysex_parse(msg)
+            return
         else:
             return
         # Callback if MIDI message in self.controls.midi_triggers
@@ -59,36 +93,135 @@ class Faderport(threading.Thread):
                 if msg.type in self.controls.midi_triggers[msg.channel][midi_id]:
                     control_object = self.controls.midi_triggers[msg.channel][midi_id][msg.type][0]
                     callback = self.controls.midi_triggers[msg.channel][midi_id][msg.type][1]
+                    # Local feedback before callback
+                    reflex = self.rules.reflexes.get(control_object)
+                    if reflex:
+                        reflex(msg)
                     callback(control_object, msg)
 
+    def subscribe(self, control_or_pattern, callback, kinds: list = None) -> Subscription:
+        """
+        Subscribe to events in-process, without going through MQTT.
+        :param control_or_pattern: control object, control name or shell-style pattern (ex. 'col*_select', '*').
+        :param callback: function(event) called from the MIDI-loop with an Event, should return quickly.
+        :param kinds: list of kinds to subscribe to (ex. ['down', 'up']), None subscribes to all kinds.
+        :return: Subscription to pass to unsubscribe().
+        """
+        return self.events.subscribe(control_or_pattern, callback, kinds=kinds)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.events.unsubscribe(subscription)
+
+    def sysex_parse(self, msg):
+        """
+        Route inbound sysex to handlers with a matching prefix, unhandled sysex is published on faderport/sysex/event.
+        """
+        data = msg.data
+        identity = DeviceIdentity.from_sysex(data)
+        if identity:
+            self._set_identity(identity)
+            return
+        handled = False
+        for prefix, callback in self.sysex_handlers:
+            if data[:len(prefix)] == prefix:
+                callback(data[len(prefix):])
+                handled = True
+        if not handled and self.controls is not None:
+            self.transport.publish(topic=f"{self.controls.mqtt_prefix}/sysex/event", payload=msg.hex())
+
+    def add_sysex_handler(self, prefix: list, callback):
+        """
+        Call callback with the rest of the data for inbound sysex starting with prefix.
+        :param prefix: list of bytes, ex. SYSEX_PREFIX_FADERPORT.
+        :param callback: function(data).
+        """
+        self.sysex_handlers.append((tuple(prefix), callback))
+
+    def probe_identity(self, timeout: float = 1.0):
+        """
+        Send an Identity Request and wait for the reply.
+        Other messages received meanwhile are returned to be parsed when the controls exist.
+        """
+        pending = []
+        self.identity = None
+        m = mido.Message('sysex')
+        m.data = IDENTITY_REQUEST
+        self.midi_user_out.send(m)
+        deadline = monotonic() + timeout
+        while self.identity is None and monotonic() < deadline:
+            msg = self.midi_user_in.receive(False)
+            if msg is None:
+                sleep(0.001)
+            elif msg.type == 'sysex' and DeviceIdentity.from_sysex(msg.data):
+                self._set_identity(DeviceIdentity.from_sysex(msg.data))
+            else:
+                pending.append(msg)
+        if self.identity is None:
+            print(f"No Identity Reply from {self.port_user_in} within {timeout} s.")
+            # Don't wait for the timeout on every start, use --probe to try again
+            self.identity_cache.set_no_identity(self.port_user_in)
+        return pending
+
+    def _set_identity(self, identity: DeviceIdentity):
+        self.identity = identity
+        self.sysex_prefix = identity.sysex_prefix
+        self.identity_cache.set_identity(self.port_user_in, identity)
+
+    def _open_ports(self):
+        try:
+            self.midi_user_in = mido.open_input(self.port_user_in)
+            self.midi_user_out = mido.open_output(self.port_user_out)
+        except IOError:
+            # Close an input port that did open, some backends only allow a port to be opened once
+            if self.midi_user_in is not None:
+                self.midi_user_in.close()
+                self.midi_user_in = None
+            if self._ports_midi_in is not None:
+                raise
+            # Cached port names are gone, enumerate ports again
+            print(f"Couldn't open cached ports {self.port_user_in}, {self.port_user_out}, searching ports.")
+            self.identity_cache.forget_ports()
+            self._find_ports()
+            self._open_ports()
+
     def run(self):
-        self.midi_user_in = mido.open_input(self.port_user_in)
-        self.midi_user_out = mido.open_output(self.port_user_out)
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_connect = self._mqtt_on_connected
-        self.mqtt_client.on_message = self._mqtt_on_message
-        self.controls = FaderportControlsMidi2MQTT(faderport=self)
-        self.mqtt_client.connect(host="127.0.0.1")
-        self.mqtt_client.loop_start()
+        self._open_ports()
+        pending = []
+        if self.probe or not self.identity_cache.is_probed(self.port_user_in):
+            pending = self.probe_identity()
+        else:
+            cached_identity = self.identity_cache.get_identity(self.port_user_in)
+            if cached_identity:
+                self._set_identity(cached_identity)
+        layout = LAYOUTS.get(self.identity.model if self.identity else "", FaderportControlsMidi2MQTT)
+        if self.transport is None:
+            self.transport = MQTTTransport()
+        self.transport.on_connect = self._mqtt_on_connected
+        self.transport.on_message = self._mqtt_on_message
+        self.controls = layout(faderport=self, taper=self.taper)
+        self.controls.mqtt_topics_in[self.hooks.name] = {"set": (self.hooks, self.hooks.callback_set_parse_mqtt)}
+        self.controls.mqtt_topics_in[self.lights.name] = {"set": (self.lights, self.lights.callback_set_parse_mqtt)}
+        self.controls.mqtt_topics_in[self.rules.name] = {"set": (self.rules, self.rules.callback_set_parse_mqtt)}
+        self.events.compile()
+        try:
+            self.rules.compile()
+        except Exception as ex:
+            # Rules were checked when loaded, a layout without their controls mustn't stop the MIDI-loop
+            print(f"Couldn't compile feedback rules, continuing without rules: {ex}")
+            self.rules.rules = []
+            self.rules.compile()
+        self.hooks.apply()
+        self.transport.start()
+        self.lights.start()
+        for msg in pending:
+            self.midi_parse(msg)
         while True:
             if self.quit:
-                self.mqtt_client.loop_stop()
+                self.lights.quit = True
+                self.transport.stop()
                 return
             msg = self.midi_user_in.receive(False)
             if msg:
-                if self.test_mode:
-                    if msg.type == 'note_on':
-                        if msg.velocity == 0:
-                            self.send_note_on(channel=msg.channel, note=msg.note, velocity=0)
-                        else:
-                            self.send_note_on(channel=msg.channel, note=msg.note, velocity=2)
-                    if msg.type == 'note_off':
-                        self.send_note_on(channel=msg.channel, note=msg.note, velocity=0)
-                    if msg.type == 'control_change':
-                        if msg.value == 127:
-                            self.send_control_change(channel=msg.channel, control=msg.control, value=2)
-                        else:
-                            self.send_control_change(channel=msg.channel, control=msg.control, value=0)
                 if self.print_midi:
                     print(f"User {msg}")
                 self.midi_parse(msg)
@@ -114,6 +247,7 @@ class Faderport(threading.Thread):
         out = f"Faderport"
         out += f"\n\t{self.midi_user_in}"
         out += f"\n\t{self.midi_user_out}"
+        out += f"\n\t{self.identity}"
         return out
 
     def send_control_change(self, channel: int, control: int, value: int):
@@ -156,6 +290,9 @@ class Faderport(threading.Thread):
         self.midi_user_out.send(m)
 
     def button_set_color(self, button: Button, color_to_set):
+        # Color set explicitly takes over the button from animations, also before their first frame is rendered
+        self.lights.release([button])
+        self.rules.sync(button, color_to_set)
         if type(color_to_set) is tuple:
             # Convert to 7-bit RGB color
             self.send_note_on(channel=button.channel + 1, note=button.midi_id, velocity=color_to_set[0] >> 1)
@@ -174,9 +311,17 @@ class Faderport(threading.Thread):
         """
         m = mido.Message('sysex')
         # Prefix Manufacturer and Product ID before the message. Mido will prefix sysex-command (240) and suffix (247).
-        m.data = SYSEX_PREFIX_FADERPORT + d
+        m.data = self.sysex_prefix + d
         self.midi_user_out.send(m)
 
+    def _find_ports(self):
+        if platform.system() == "Windows":
+            self.port_user_in = self._find_port(self._port_user_in_search, "PreSonus.*0", direction_in=True)
+            self.port_user_out = self._find_port(self._port_user_out_search, "PreSonus.*1", direction_in=False)
+        else:
+            self.port_user_in = self._find_port(self._port_user_in_search, "PreSonus.*FP8", direction_in=True)
+            self.port_user_out = self._find_port(self._port_user_out_search, "PreSonus.*FP8", direction_in=False)
+
     def _find_port(self, port_name: str, fallback: str, direction_in: bool = True) -> str:
         if port_name:
             port_name_to_search = port_name
@@ -186,16 +331,26 @@ class Faderport(threading.Thread):
             port_name_to_search = ".*" + port_name_to_search
         if not port_name_to_search.endswith(".*"):
             port_name_to_search += ".*"
+        cache_key = f"{'in' if direction_in else 'out'}:{port_name_to_search}"
+        cached_port = self.identity_cache.get_port(cache_key)
+        if cached_port:
+            return cached_port
         r = re.compile(port_name_to_search, re.IGNORECASE)
         if direction_in:
-            port_matches = list(filter(r.match, self._ports_midi_in))
+            if self._ports_midi_in is None:
+                self._ports_midi_in = mido.get_input_names()
+            ports = self._ports_midi_in
         else:
-            port_matches = list(filter(r.match, self._ports_midi_out))
+            if self._ports_midi_out is None:
+                self._ports_midi_out = mido.get_output_names()
+            ports = self._ports_midi_out
+        port_matches = list(filter(r.match, ports))
         found_port = next(iter(port_matches), None)
         if found_port:
+            self.identity_cache.set_port(cache_key, found_port)
             return found_port
         else:
-            raise Exception(f"Couldn't find {port_name} in listed IO-ports {self._ports_midi}.")
+            raise Exception(f"Couldn't find {port_name_to_search} in listed IO-ports {ports}.")
 
 
 if __name__ == '__main__':
@@ -218,6 +373,27 @@ if __name__ == '__main__':
     parser.add_argument('--test', '-t',
                         action='store_true',
                         help='Test-mode write control-values back so buttons light up.')
+    parser.add_argument('--taper',
+                        type=str, default="audio", choices=list(TAPERS),
+                        help='Fader taper for normalized and dB topics. Default: audio')
+    parser.add_argument('--profilingpath',
+                        type=str, default="",
+                        help='Append profiling reports to this file instead of publishing them on '
+                             'faderport/profiling/report.')
+    parser.add_argument('--local',
+                        type=str, nargs='?', const=LOCAL_PATH_DEFAULT, default="",
+                        help='Serve topics broker-less over a Unix domain socket instead of MQTT. '
+                             f'Default: {LOCAL_PATH_DEFAULT}')
+    parser.add_argument('--rules', '-r',
+                        type=str, default="",
+                        help='JSON file with local feedback rules, ex. toggle, radio groups and touch lights.')
+    parser.add_argument('--identitycache',
+                        type=str, default=IDENTITY_CACHE_DEFAULT,
+                        help='JSON file caching port names and device identity, empty disables caching. '
+                             f'Default: {IDENTITY_CACHE_DEFAULT}')
+    parser.add_argument('--probe',
+                        action='store_true',
+                        help='Probe device identity even if it is cached.')
     parser.add_argument('--printports', '-l',
                         action='store_true',
                         help='Lists available MIDI IO ports.')
@@ -240,14 +416,25 @@ if __name__ == '__main__':
         faderport = Faderport(print_midi=args.printmidi,
                               port_user_in=args.midiportuserin,
                               port_user_out=args.midiportuserout,
-                              test_mode=args.test)
+                              test_mode=args.test,
+                              taper=TAPERS[args.taper](),
+                              profiling_path=args.profilingpath,
+                              transport=LocalTransport(path=args.local) if args.local else MQTTTransport(),
+                              rules_path=args.rules,
+                              identity_cache_path=args.identitycache,
+                              probe=args.probe)
         faderport.start()
         if args.shell:
             from pysh.shell import Pysh  # https://github.com/TimGremalm/pysh
 
             banner = [f"{title_long} Shell",
                       'You may leave this shell by typing `exit`, `q` or pressing Ctrl+D',
-                      'faderport is the main object.']
+                      'faderport is the main object.',
+                      'faderport.hooks.enable_stats() and faderport.hooks.enable_profile() start profiling, '
+                      'faderport.hooks.report() writes the results.',
+                      'faderport.lights animates RGB buttons, ex. '
+                      'faderport.lights.meter(faderport.controls.col1_select, 0.5).',
+                      'faderport.subscribe("col*_select", print) prints events in-process.']
             Pysh(dict_to_include={'faderport': faderport},
                  prompt=f"{title_short}$ ",
                  banner=banner)
@@ -0,0 +1,336 @@
+import threading
+from math import cos, isfinite, pi
+from time import monotonic, sleep
+from Faderport.constants import *
+from Faderport.helper_functions import try_parse_int
+
+"""
+Render animations and meters on RGB buttons in-process. All animations are rendered into one frame at a fixed rate,
+only color components that changed since the last frame are sent to the Faderport.
+Colors are 7-bit RGB tuples (0-127) internally, the resolution of the Faderport.
+"""
+GRADIENT_METER = [(0, 0, 0), (0, 255, 0), (255, 255, 0), (255, 0, 0)]
+GRADIENT_STEPS = 128
+BLACK = (0, 0, 0)
+
+
+def compile_gradient(stops: list, steps: int = GRADIENT_STEPS) -> list:
+    """
+    Compile a gradient into a lookup table of 7-bit colors.
+    :param stops: list of 8-bit (red, green, blue) tuples spread evenly from level 0.0 to 1.0.
+    :param steps: int number of entries in table.
+    """
+    if len(stops) < 2:
+        raise Exception(f"Gradient needs at least two colors, got {stops}.")
+    table = []
+    for i in range(steps):
+        position = i / (steps - 1) * (len(stops) - 1)
+        index = min(int(position), len(stops) - 2)
+        fraction = position - index
+        a = stops[index]
+        b = stops[index + 1]
+        table.append(tuple(int(a[c] + (b[c] - a[c]) * fraction + 0.5) >> 1 for c in range(3)))
+    return table
+
+
+def parse_rgb(argument: str) -> tuple:
+    """
+    Parse "Red,Green,Blue" (ex. "255,127,0") to a tuple.
+    """
+    rgb = argument.split(",")
+    if len(rgb) != 3:
+        raise Exception(f"Couldn't parse RGB from color {argument}, it should be comma,separated like R,G,B.")
+    color = tuple(try_parse_int(c) for c in rgb)
+    for c in color:
+        if c is None or c < 0 or c > 255:
+            raise Exception(f"Couldn't parse RGB from color {argument}, values must be 0 to 255.")
+    return color
+
+
+def check_level(level: float) -> float:
+    if not isfinite(level) or level < 0.0:
+        raise Exception(f"Level {level} must be a finite number from 0.0.")
+    return level
+
+
+def check_period(period: float) -> float:
+    if not isfinite(period) or period <= 0.0:
+        raise Exception(f"Period {period} must be a finite number of seconds above 0.")
+    return period
+
+
+class Animation:
+    def __init__(self, buttons: list):
+        """
+        Base class of an animation, subclasses implement render().
+        :param buttons: list of RGB Button objects covered by the animation.
+        """
+        for button in buttons:
+            if button.luminance_type != LightTypes.RGB:
+                raise Exception(f"Button {button.name} is not RGB, can't be animated.")
+        self.buttons = buttons
+        self.start = monotonic()
+
+    def render(self, now: float, frame: dict):
+        """
+        Render colors of all covered buttons into frame.
+        :param now: float monotonic time.
+        :param frame: dict of button -> 7-bit (red, green, blue).
+        """
+        raise Exception(f"Animation {type(self).__name__} doesn't implement render().")
+
+    def __repr__(self):
+        out = f"{type(self).__name__}(buttons={[button.name for button in self.buttons]}"
+        out += f")"
+        return out
+
+
+class MeterAnimation(Animation):
+    def __init__(self, button, level: float = 0.0, gradient: list = None):
+        """
+        Level meter, button shows the gradient color of the level.
+        :param level: float 0.0 to 1.0.
+        :param gradient: list of 8-bit (red, green, blue) stops, defaults to black, green, yellow, red.
+        """
+        super(MeterAnimation, self).__init__(buttons=[button])
+        self.table = compile_gradient(gradient if gradient else GRADIENT_METER)
+        self.level = check_level(level)
+
+    def render(self, now: float, frame: dict):
+        level = self.level
+        if level <= 0.0:
+            frame[self.buttons[0]] = self.table[0]
+        elif level >= 1.0:
+            frame[self.buttons[0]] = self.table[-1]
+        else:
+            frame[self.buttons[0]] = self.table[int(level * (GRADIENT_STEPS - 1) + 0.5)]
+
+
+class PulseAnimation(Animation):
+    def __init__(self, buttons: list, color: tuple, period: float = 1.0):
+        """
+        Fade color in and out.
+        :param color: 8-bit (red, green, blue).
+        :param period: float seconds of one pulse.
+        """
+        super(PulseAnimation, self).__init__(buttons=buttons)
+        self.table = compile_gradient([BLACK, color])
+        self.period = check_period(period)
+
+    def render(self, now: float, frame: dict):
+        brightness = 0.5 - 0.5 * cos(2 * pi * (now - self.start) / self.period)
+        color = self.table[int(brightness * (GRADIENT_STEPS - 1) + 0.5)]
+        for button in self.buttons:
+            frame[button] = color
+
+
+class ChaseAnimation(Animation):
+    def __init__(self, buttons: list, color: tuple, period: float = 1.0):
+        """
+        Light one button at a time, moving along buttons.
+        :param color: 8-bit (red, green, blue).
+        :param period: float seconds to move through all buttons.
+        """
+        super(ChaseAnimation, self).__init__(buttons=buttons)
+        self.color = tuple(c >> 1 for c in color)
+        self.period = check_period(period)
+
+    def render(self, now: float, frame: dict):
+        lit = int((now - self.start) / self.period * len(self.buttons)) % len(self.buttons)
+        for i, button in enumerate(self.buttons):
+            frame[button] = self.color if i == lit else BLACK
+
+
+class LightEngine(threading.Thread):
+    def __init__(self, faderport, rate: float = 30.0):
+        """
+        Render animations on RGB buttons at a fixed frame rate.
+        Can be controlled over MQTT, per button on faderport/<button>/set_meter with payload level 0.0 to 1.0 and
+        faderport/<button>/set_animation with payload 'meter [R,G,B ...]', 'pulse R,G,B [period]' or 'off'.
+        Over several buttons on faderport/animation/set with payload 'chase R,G,B [period] [button,button,...]',
+        'pulse R,G,B [period] [button,button,...]' or 'off'.
+        :param faderport: Faderport object to send MIDI with.
+        :param rate: float frames per second.
+        """
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.name = "animation"
+        self.faderport = faderport
+        self.period = 1.0 / rate
+        self.animations = []
+        # Last sent 7-bit color per button
+        self.sent = {}
+        self.quit = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        next_frame = monotonic()
+        while not self.quit:
+            if self.animations:
+                self.render(monotonic())
+            next_frame += self.period
+            delay = next_frame - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                # Frames are late, skip ahead instead of catching up
+                next_frame = monotonic()
+
+    def render(self, now: float):
+        frame = {}
+        with self._lock:
+            failed = []
+            for animation in self.animations:
+                try:
+                    animation.render(now, frame)
+                except Exception as ex:
+                    # A failing animation mustn't stop the engine, drop it and keep rendering the others
+                    print(f"Animation {animation} failed: {ex}")
+                    failed.append(animation)
+            if failed:
+                self.animations = [animation for animation in self.animations if animation not in failed]
+            # Send while holding the lock, a button released meanwhile by set_light mustn't get a stale frame
+            for button, color in frame.items():
+                self._send(button, color)
+
+    def _send(self, button, color: tuple):
+        last = self.sent.get(button)
+        if last == color:
+            return
+        # Each component is a Note-On on its own channel, only send changed components
+        for c in range(3):
+            if last is None or last[c] != color[c]:
+                self.faderport.send_note_on(channel=button.channel + 1 + c, note=button.midi_id, velocity=color[c])
+        self.sent[button] = color
+
+    def add(self, animation: Animation) -> Animation:
+        """
+        Add an animation, buttons are taken over from animations already covering them.
+        """
+        with self._lock:
+            self._release(animation.buttons)
+            self.animations.append(animation)
+        for button in animation.buttons:
+            # Let next set_light through
+            button.light = None
+        return animation
+
+    def release(self, buttons: list):
+        """
+        Stop animations on buttons without turning them off, ex. when a color is set with set_light.
+        """
+        with self._lock:
+            self._release(buttons)
+            for button in buttons:
+                self.sent.pop(button, None)
+
+    def stop(self, buttons: list = None):
+        """
+        Stop animations on buttons and turn them off.
+        :param buttons: list of Button objects, None stops all animations.
+        """
+        with self._lock:
+            if buttons is None:
+                buttons = [button for animation in self.animations for button in animation.buttons]
+                self.animations = []
+            else:
+                self._release(buttons)
+            for button in buttons:
+                self._send(button, BLACK)
+                self.sent.pop(button, None)
+        for button in buttons:
+            # Let next set_light through
+            button.light = None
+
+    def _release(self, buttons: list):
+        animations = []
+        for animation in self.animations:
+            animation.buttons = [button for button in animation.buttons if button not in buttons]
+            if animation.buttons:
+                animations.append(animation)
+        self.animations = animations
+
+    def meter(self, button, level: float, gradient: list = None) -> MeterAnimation:
+        """
+        Set meter level of button, a meter is started if button doesn't show one.
+        """
+        check_level(level)
+        table = compile_gradient(gradient) if gradient is not None else None
+        with self._lock:
+            for animation in self.animations:
+                if type(animation) is MeterAnimation and animation.buttons[0] is button:
+                    if table is not None:
+                        animation.table = table
+                    animation.level = level
+                    return animation
+        return self.add(MeterAnimation(button=button, level=level, gradient=gradient))
+
+    def pulse(self, buttons: list, color: tuple, period: float = 1.0) -> PulseAnimation:
+        return self.add(PulseAnimation(buttons=buttons, color=color, period=period))
+
+    def chase(self, buttons: list, color: tuple, period: float = 1.0) -> ChaseAnimation:
+        return self.add(ChaseAnimation(buttons=buttons, color=color, period=period))
+
+    def _parse_buttons(self, argument: str) -> list:
+        buttons = []
+        for name in argument.split(","):
+            button = getattr(self.faderport.controls, name, None)
+            if button is None or button not in self.faderport.controls.elements:
+                raise Exception(f"Couldn't find button {name}.")
+            buttons.append(button)
+        return buttons
+
+    def _select_buttons(self) -> list:
+        return [getattr(self.faderport.controls, f"col{col}_select") for col in range(1, 9)]
+
+    def callback_button_set_animation_parse_mqtt(self, topics, control_object, msg):
+        try:
+            arguments = msg.payload.decode().split()
+            if topics[2] == "set_meter":
+                level = float(arguments[0]) if arguments else 0.0
+                self.meter(control_object, level)
+            elif topics[2] == "set_animation":
+                if not arguments:
+                    raise Exception(f"Animation is empty.")
+                if arguments[0] == "meter":
+                    gradient = [parse_rgb(argument) for argument in arguments[1:]]
+                    self.meter(control_object, 0.0, gradient=gradient if gradient else None)
+                elif arguments[0] == "pulse" and len(arguments) >= 2:
+                    period = float(arguments[2]) if len(arguments) >= 3 else 1.0
+                    self.pulse([control_object], parse_rgb(arguments[1]), period)
+                elif arguments[0] == "off":
+                    self.stop([control_object])
+                else:
+                    raise Exception(f"Couldn't parse animation {msg.payload.decode()}.")
+            else:
+                print(f"callback_button_set_animation_parse_mqtt() Couldn't parse topic {topics[2]}.")
+                return
+        except Exception as ex:
+            self.faderport.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+
+    def callback_set_parse_mqtt(self, topics, control_object, msg):
+        try:
+            if topics[2] != "set":
+                print(f"callback_set_parse_mqtt() Couldn't parse topic {topics[2]}.")
+                return
+            arguments = msg.payload.decode().split()
+            if not arguments:
+                raise Exception(f"Animation is empty.")
+            if arguments[0] in ("chase", "pulse") and len(arguments) >= 2:
+                period = float(arguments[2]) if len(arguments) >= 3 else 1.0
+                buttons = self._parse_buttons(arguments[3]) if len(arguments) >= 4 else self._select_buttons()
+                if arguments[0] == "chase":
+                    self.chase(buttons, parse_rgb(arguments[1]), period)
+                else:
+                    self.pulse(buttons, parse_rgb(arguments[1]), period)
+            elif arguments[0] == "off":
+                self.stop()
+            else:
+                raise Exception(f"Couldn't parse animation {msg.payload.decode()}.")
+        except Exception as ex:
+            self.faderport.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+
+    def __repr__(self):
+        out = f"LightEngine(rate={1.0 / self.period:.0f}, animations={self.animations}"
+        out += f")"
+        return out
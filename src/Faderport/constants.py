@@ -10,6 +10,15 @@ record sysex data=(127,127,6,6)
 0x02 - Product model ID Faderport 8
 """
 SYSEX_PREFIX_FADERPORT = [0x00, 0x01, 0x06, 0x02]
+MANUFACTURER_PRESONUS = [0x00, 0x01, 0x06]
+
+"""
+Product model ID to model name, the model ID is the low byte of the family code in an Identity Reply.
+"""
+FADERPORT_MODELS = {
+    0x02: "FP8",
+    0x16: "FP16",
+}
 
 
 class MIDIType(Enum):
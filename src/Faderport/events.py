@@ -0,0 +1,119 @@
+from fnmatch import fnmatchcase
+from time import monotonic
+
+"""
+In-process event bus for Python consumers of the controls, ex. the shell or plugins.
+Subscribers are matched against every control when subscribing, so publishing an event is a lookup per control and
+kind. Callbacks run in the thread publishing the event, usually the MIDI-loop, and should return quickly.
+The MQTT bridge is a subscriber of all events.
+"""
+
+
+class Event:
+    __slots__ = ("control", "kind", "value", "timestamp")
+
+    def __init__(self, control, kind: str, value, timestamp: float):
+        """
+        :param control: control object, ex. Button, PitchWheel or Knob.
+        :param kind: str kind of event, same as the topic after event/ (ex. 'down', 'touch', 'pitch', 'rotate').
+        :param value: int value, same as the MQTT payload. float gain for normalized and float level for db.
+        :param timestamp: float time.monotonic() when the event was published.
+        """
+        self.control = control
+        self.kind = kind
+        self.value = value
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"Event(control='{self.control.name}', kind='{self.kind}', value={self.value}, " \
+               f"timestamp={self.timestamp:.6f})"
+
+
+class Subscription:
+    __slots__ = ("pattern", "callback", "kinds")
+
+    def __init__(self, pattern, callback, kinds: list = None):
+        self.pattern = pattern
+        self.callback = callback
+        self.kinds = kinds
+
+    def matches(self, control, kind: str) -> bool:
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if type(self.pattern) is str:
+            return fnmatchcase(control.name, self.pattern)
+        return self.pattern is control
+
+    def __repr__(self):
+        pattern = self.pattern if type(self.pattern) is str else self.pattern.name
+        return f"Subscription(pattern='{pattern}', callback={self.callback}, kinds={self.kinds})"
+
+
+class EventBus:
+    def __init__(self, faderport):
+        """
+        Event bus for the controls of a Faderport.
+        :param faderport: Faderport object owning the controls.
+        """
+        self.faderport = faderport
+        self.subscriptions = []
+        # Precompiled callbacks, subscribers[control][kind] = tuple of callbacks
+        self.subscribers = {}
+
+    def subscribe(self, control_or_pattern, callback, kinds: list = None) -> Subscription:
+        """
+        Subscribe to events of controls.
+        :param control_or_pattern: control object, control name or shell-style pattern (ex. 'col*_select', '*').
+        :param callback: function(event) called with an Event.
+        :param kinds: list of kinds to subscribe to (ex. ['down']), None subscribes to all kinds.
+        :return: Subscription to pass to unsubscribe().
+        """
+        subscription = Subscription(pattern=control_or_pattern, callback=callback, kinds=kinds)
+        self.subscriptions.append(subscription)
+        self.compile()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.remove(subscription)
+        self.compile()
+
+    def compile(self):
+        """
+        Match subscriptions against the event kinds of every control.
+        Called when subscriptions change and when the controls are created.
+        """
+        controls = self.faderport.controls
+        if controls is None:
+            return
+        subscribers = {}
+        for element in controls.elements:
+            kinds = {}
+            for topic in controls.mqtt_topics_out.get(element.name, {}):
+                kind = topic.split("/")[-1]
+                callbacks = tuple(subscription.callback for subscription in self.subscriptions
+                                  if subscription.matches(element, kind))
+                if callbacks:
+                    kinds[kind] = callbacks
+            if kinds:
+                subscribers[element] = kinds
+        self.subscribers = subscribers
+
+    def publish(self, control, kind: str, value):
+        kinds = self.subscribers.get(control)
+        if kinds is None:
+            return
+        callbacks = kinds.get(kind)
+        if callbacks is None:
+            return
+        event = Event(control, kind, value, monotonic())
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as ex:
+                # A failing subscriber mustn't stop the MIDI-loop or other subscribers
+                print(f"Event subscriber {callback} failed on {event}: {ex}")
+
+    def __repr__(self):
+        out = f"EventBus(subscriptions={self.subscriptions}"
+        out += f")"
+        return out
@@ -0,0 +1,322 @@
+import cProfile
+import heapq
+import io
+import pstats
+import threading
+from time import perf_counter, strftime
+
+"""
+Pre/post hooks on the dispatch paths of midi_triggers and mqtt_topics_in.
+Hooks are installed by wrapping the callbacks in the dispatch tables, without any registered hook the tables hold
+the plain callbacks and dispatch costs nothing extra.
+Reflexes of the local feedback rules run in midi_parse before the callback, outside the hooked region, and are not
+measured.
+"""
+
+
+class DispatchHook:
+    def __init__(self, name: str, controls: list = None, kinds: list = None):
+        """
+        Base class of a dispatch hook, override pre() and/or post().
+        :param name: str name of hook, used in reports.
+        :param controls: list of control names to hook, None hooks all controls.
+        :param kinds: list of message kinds to hook, MIDI types (ex. 'note_on', 'pitchwheel') or
+                      MQTT topics (ex. 'set_light'). None hooks all kinds.
+        """
+        self.name = name
+        self.controls = controls
+        self.kinds = kinds
+        self.writer = None
+
+    def matches(self, control_name: str, kind: str) -> bool:
+        if self.controls is not None and control_name not in self.controls:
+            return False
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        return True
+
+    def pre(self, control_object, kind: str, msg):
+        pass
+
+    def post(self, control_object, kind: str, msg, duration: float):
+        pass
+
+    def report(self) -> str:
+        return ""
+
+    def __repr__(self):
+        out = f"{type(self).__name__}(name='{self.name}', controls={self.controls}, kinds={self.kinds}"
+        out += f")"
+        return out
+
+
+class StatsHook(DispatchHook):
+    def __init__(self, controls: list = None, kinds: list = None, slowest: int = 10):
+        """
+        Count events and time spent per control and kind, and keep track of the slowest callbacks.
+        :param slowest: int number of slowest callbacks to keep.
+        """
+        super(StatsHook, self).__init__(name="stats", controls=controls, kinds=kinds)
+        self.slowest_count = slowest
+        self.counts = {}
+        self.slowest = []
+
+    def post(self, control_object, kind: str, msg, duration: float):
+        key = (control_object.name, kind)
+        count = self.counts.get(key)
+        if count is None:
+            self.counts[key] = [1, duration, duration]
+        else:
+            count[0] += 1
+            count[1] += duration
+            if duration > count[2]:
+                count[2] = duration
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (duration, control_object.name, kind))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, control_object.name, kind))
+
+    def reset(self):
+        self.counts = {}
+        self.slowest = []
+
+    def report(self) -> str:
+        # Snapshot, post() keeps counting in the MIDI-loop while the report is formatted
+        counts = dict(self.counts)
+        slowest = list(self.slowest)
+        out = f"{'control':<24} {'kind':<16} {'count':>8} {'total ms':>10} {'mean us':>10} {'max us':>10}"
+        for (name, kind), (count, total, maximum) in sorted(counts.items()):
+            out += f"\n{name:<24} {kind:<16} {count:>8} {total * 1e3:>10.3f} " \
+                   f"{total / count * 1e6:>10.1f} {maximum * 1e6:>10.1f}"
+        out += f"\nSlowest callbacks"
+        for duration, name, kind in sorted(slowest, reverse=True):
+            out += f"\n{name:<24} {kind:<16} {duration * 1e6:>10.1f} us"
+        return out
+
+
+class ProfileHook(DispatchHook):
+    def __init__(self, controls: list = None, kinds: list = None,
+                 window: float = 5.0, interval: float = 60.0, sort: str = "cumulative", lines: int = 25):
+        """
+        Sample the hooked callbacks with cProfile during a window, then write the stats and wait for next window.
+        :param window: float seconds to profile.
+        :param interval: float seconds between the end of a window and the start of the next.
+        :param sort: str pstats sort key.
+        :param lines: int number of functions in report.
+        """
+        super(ProfileHook, self).__init__(name="profile", controls=controls, kinds=kinds)
+        self.window = window
+        self.interval = interval
+        self.sort = sort
+        self.lines = lines
+        self.profile = None
+        self.window_end = 0.0
+        self.next_window = 0.0
+        self.last_report = ""
+        # Only one profiler can be enabled at a time, MIDI and MQTT callbacks run in separate threads
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def pre(self, control_object, kind: str, msg):
+        if self.profile is None and perf_counter() < self.next_window:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.window_end = perf_counter() + self.window
+        try:
+            # Raises if another profiler is enabled, ex. on Python 3.12 and later
+            self.profile.enable()
+        except Exception:
+            self._lock.release()
+            raise
+        self._local.enabled = True
+
+    def post(self, control_object, kind: str, msg, duration: float):
+        if not getattr(self._local, "enabled", False):
+            return
+        self.profile.disable()
+        self._local.enabled = False
+        now = perf_counter()
+        if now >= self.window_end:
+            self.last_report = self._format(self.profile)
+            self.profile = None
+            self.next_window = now + self.interval
+            self._lock.release()
+            if self.writer:
+                self.writer(self.name, self.last_report)
+        else:
+            self._lock.release()
+
+    def _format(self, profile: cProfile.Profile) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(self.sort).print_stats(self.lines)
+        return stream.getvalue()
+
+    def report(self) -> str:
+        return self.last_report
+
+
+class DispatchHooks:
+    def __init__(self, faderport, report_path: str = ""):
+        """
+        Registry of dispatch hooks for a Faderport.
+        Can be controlled over MQTT on topic faderport/profiling/set with payload
+        'stats', 'profile [window] [interval]', 'report' or 'off'.
+        :param faderport: Faderport object owning the dispatch tables.
+        :param report_path: str file to append reports to, reports are published on faderport/profiling/report if empty.
+        """
+        self.name = "profiling"
+        self.faderport = faderport
+        self.report_path = report_path
+        self.hooks = []
+        # List of (table, key, original_entry) replaced by wrapped callbacks
+        self._originals = []
+
+    def add(self, hook: DispatchHook) -> DispatchHook:
+        """
+        Register a hook, replacing a registered hook with the same name.
+        """
+        for registered in [registered for registered in self.hooks if registered.name == hook.name]:
+            self.hooks.remove(registered)
+            registered.writer = None
+        hook.writer = self.write
+        self.hooks.append(hook)
+        self.apply()
+        return hook
+
+    def remove(self, hook: DispatchHook):
+        self.hooks.remove(hook)
+        hook.writer = None
+        self.apply()
+
+    def clear(self):
+        for hook in self.hooks:
+            hook.writer = None
+        self.hooks = []
+        self.apply()
+
+    def enable_stats(self, controls: list = None, kinds: list = None) -> StatsHook:
+        return self.add(StatsHook(controls=controls, kinds=kinds))
+
+    def enable_profile(self, window: float = 5.0, interval: float = 60.0,
+                       controls: list = None, kinds: list = None) -> ProfileHook:
+        return self.add(ProfileHook(controls=controls, kinds=kinds, window=window, interval=interval))
+
+    def apply(self):
+        """
+        Restore the dispatch tables and wrap callbacks matching registered hooks.
+        Called when hooks change and when the controls are created.
+        """
+        for table, key, entry in self._originals:
+            table[key] = entry
+        self._originals = []
+        controls = self.faderport.controls
+        if controls is None or not self.hooks:
+            return
+        # Set midi_triggers[channel][midi_id][type] = (control_object, hooked_callback)
+        for midi_ids in controls.midi_triggers.values():
+            for midi_types in midi_ids.values():
+                for midi_type, entry in list(midi_types.items()):
+                    hooks = [hook for hook in self.hooks if hook.matches(entry[0].name, midi_type)]
+                    if hooks:
+                        self._originals.append((midi_types, midi_type, entry))
+                        midi_types[midi_type] = (entry[0], self._wrap_midi(entry[1], hooks, midi_type))
+        # Set mqtt_topics_in[name][topic] = (control_object, hooked_callback)
+        for topics in controls.mqtt_topics_in.values():
+            for topic, entry in list(topics.items()):
+                if entry[0] is self:
+                    continue
+                hooks = [hook for hook in self.hooks if hook.matches(entry[0].name, topic)]
+                if hooks:
+                    self._originals.append((topics, topic, entry))
+                    topics[topic] = (entry[0], self._wrap_mqtt(entry[1], hooks, topic))
+
+    @staticmethod
+    def _wrap_midi(callback, hooks: list, kind: str):
+        # Post hooks run in reverse order so hooks nest around the callback
+        hooks_reversed = hooks[::-1]
+
+        def hooked_callback(control_object, msg):
+            start = perf_counter()
+            try:
+                DispatchHooks._pre(hooks, control_object, kind, msg)
+                start = perf_counter()
+                callback(control_object, msg)
+            finally:
+                DispatchHooks._post(hooks_reversed, control_object, kind, msg, perf_counter() - start)
+        return hooked_callback
+
+    @staticmethod
+    def _wrap_mqtt(callback, hooks: list, kind: str):
+        hooks_reversed = hooks[::-1]
+
+        def hooked_callback(topics, control_object, msg):
+            start = perf_counter()
+            try:
+                DispatchHooks._pre(hooks, control_object, kind, msg)
+                start = perf_counter()
+                callback(topics, control_object, msg)
+            finally:
+                DispatchHooks._post(hooks_reversed, control_object, kind, msg, perf_counter() - start)
+        return hooked_callback
+
+    @staticmethod
+    def _pre(hooks: list, control_object, kind: str, msg):
+        # A failing hook mustn't break dispatch of the callback or other hooks
+        for hook in hooks:
+            try:
+                hook.pre(control_object, kind, msg)
+            except Exception as ex:
+                print(f"Dispatch hook {hook.name} failed in pre() on {control_object.name} {kind}: {ex}")
+
+    @staticmethod
+    def _post(hooks: list, control_object, kind: str, msg, duration: float):
+        for hook in hooks:
+            try:
+                hook.post(control_object, kind, msg, duration)
+            except Exception as ex:
+                print(f"Dispatch hook {hook.name} failed in post() on {control_object.name} {kind}: {ex}")
+
+    def report(self):
+        """
+        Write reports of all registered hooks.
+        """
+        for hook in self.hooks:
+            self.write(hook.name, hook.report())
+
+    def write(self, name: str, text: str):
+        if self.report_path:
+            with open(self.report_path, "a") as f:
+                f.write(f"{strftime('%Y-%m-%d %H:%M:%S')} {name}\n{text}\n")
+        else:
+            self.faderport.transport.publish(topic=f"{self.faderport.controls.mqtt_prefix}/{self.name}/report",
+                                             payload=f"{name}\n{text}")
+
+    def callback_set_parse_mqtt(self, topics, control_object, msg):
+        try:
+            if topics[2] != "set":
+                print(f"callback_set_parse_mqtt() Couldn't parse topic {topics[2]}.")
+                return
+            arguments = msg.payload.decode().split()
+            if not arguments:
+                raise Exception(f"Profiling command is empty.")
+            if arguments[0] == "stats":
+                self.enable_stats()
+            elif arguments[0] == "profile":
+                self.enable_profile(*[float(argument) for argument in arguments[1:3]])
+            elif arguments[0] == "report":
+                self.report()
+            elif arguments[0] == "off":
+                self.clear()
+            else:
+                raise Exception(f"Unknown profiling command {arguments[0]}.")
+        except Exception as ex:
+            self.faderport.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+
+    def __repr__(self):
+        out = f"DispatchHooks(hooks={self.hooks}"
+        out += f")"
+        return out
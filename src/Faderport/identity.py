@@ -0,0 +1,159 @@
+import json
+import os
+from Faderport.constants import *
+
+"""
+Device identity of the Faderport from a MIDI Identity Request, cached on disk per port name so restarts skip the probe
+and the port enumeration.
+
+Identity Request F0 7E 7F 06 01 F7
+Identity Reply   F0 7E <device> 06 02 <manufacturer 1 or 3 bytes> <family 2 bytes> <member 2 bytes> <version 4 bytes> F7
+Mido strips F0 and F7 from sysex data.
+"""
+IDENTITY_REQUEST = [0x7E, 0x7F, 0x06, 0x01]
+IDENTITY_CACHE_DEFAULT = os.path.join(os.path.expanduser("~"), ".cache", "pyFaderport", "identity.json")
+
+
+class DeviceIdentity:
+    def __init__(self, manufacturer: list, family: int, member: int, version: list):
+        self.manufacturer = manufacturer
+        self.family = family
+        self.member = member
+        self.version = version
+
+    @classmethod
+    def from_sysex(cls, data):
+        """
+        Parse an Identity Reply.
+        :param data: sysex data without F0 and F7.
+        :return: DeviceIdentity or None if data isn't an Identity Reply.
+        """
+        if len(data) < 5 or data[0] != 0x7E or data[2] != 0x06 or data[3] != 0x02:
+            return None
+        # Manufacturer ID is 3 bytes if first byte is 0
+        manufacturer_length = 3 if data[4] == 0x00 else 1
+        body = list(data[4 + manufacturer_length:])
+        if len(body) < 8:
+            return None
+        return cls(manufacturer=list(data[4:4 + manufacturer_length]),
+                   family=body[0] | body[1] << 7,
+                   member=body[2] | body[3] << 7,
+                   version=body[4:8])
+
+    @property
+    def model(self) -> str:
+        """
+        Model name from the product model ID, or empty string if it's not a known Faderport.
+        """
+        if self.manufacturer != MANUFACTURER_PRESONUS:
+            return ""
+        return FADERPORT_MODELS.get(self.family & 0x7F, "")
+
+    @property
+    def firmware(self) -> str:
+        return ".".join(str(v) for v in self.version)
+
+    @property
+    def sysex_prefix(self) -> list:
+        """
+        Prefix for sysex to this model, manufacturer ID and product model ID.
+        """
+        if not self.model:
+            return SYSEX_PREFIX_FADERPORT
+        return self.manufacturer + [self.family & 0x7F]
+
+    def to_dict(self) -> dict:
+        return {"manufacturer": self.manufacturer, "family": self.family,
+                "member": self.member, "version": self.version}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(manufacturer=d["manufacturer"], family=d["family"], member=d["member"], version=d["version"])
+
+    def __repr__(self):
+        out = f"DeviceIdentity(model='{self.model}', firmware='{self.firmware}', " \
+              f"manufacturer={self.manufacturer}, family={self.family}, member={self.member}"
+        out += f")"
+        return out
+
+
+class IdentityCache:
+    def __init__(self, path: str = IDENTITY_CACHE_DEFAULT):
+        """
+        Cache of resolved port names and device identity per port name in a JSON file.
+        :param path: str path of JSON file, caching is disabled if empty.
+        """
+        self.path = path
+        self.ports = {}
+        self.identities = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    d = json.load(f)
+                self.ports = d.get("ports", {})
+                self.identities = d.get("identities", {})
+            except (OSError, ValueError) as ex:
+                # A broken cache is only a cache miss
+                print(f"Couldn't read identity cache {self.path}: {ex}")
+
+    def get_port(self, key: str) -> str:
+        return self.ports.get(key, "")
+
+    def set_port(self, key: str, port_name: str):
+        if self.ports.get(key) == port_name:
+            return
+        self.ports[key] = port_name
+        self.save()
+
+    def forget_ports(self):
+        self.ports = {}
+        self.save()
+
+    def is_probed(self, port_name: str) -> bool:
+        """
+        True if port was probed before, with or without an Identity Reply.
+        """
+        return port_name in self.identities
+
+    def get_identity(self, port_name: str):
+        d = self.identities.get(port_name)
+        if not d:
+            return None
+        try:
+            return DeviceIdentity.from_dict(d)
+        except (KeyError, TypeError):
+            return None
+
+    def set_identity(self, port_name: str, identity: DeviceIdentity):
+        if self.identities.get(port_name) == identity.to_dict():
+            return
+        self.identities[port_name] = identity.to_dict()
+        self.save()
+
+    def set_no_identity(self, port_name: str):
+        """
+        Cache that port didn't answer the Identity Request, an empty entry.
+        """
+        if self.identities.get(port_name) == {}:
+            return
+        self.identities[port_name] = {}
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write to a temporary file and replace, a crash can't leave a half written cache
+            path_temp = f"{self.path}.tmp"
+            with open(path_temp, "w") as f:
+                json.dump({"ports": self.ports, "identities": self.identities}, f, indent=2)
+            os.replace(path_temp, self.path)
+        except OSError as ex:
+            print(f"Couldn't write identity cache {self.path}: {ex}")
+
+    def __repr__(self):
+        out = f"IdentityCache(path='{self.path}', ports={len(self.ports)}, identities={len(self.identities)}"
+        out += f")"
+        return out
@@ -0,0 +1,240 @@
+import json
+import threading
+from Faderport.constants import *
+from Faderport.structure import Button, FaderportControls
+from Faderport.animation import parse_rgb
+
+"""
+Local feedback rules light buttons directly from MIDI input, without a round trip over MQTT.
+Rules are compiled into reflexes per control which midi_parse calls before the control's callback.
+
+Rules are a JSON list, or a JSON object with the list under "rules". Controls are a list of names or "*" for all
+buttons, colors are a palette name (ex. "Lit"), an integer or "R,G,B" for RGB buttons.
+  {"type": "momentary", "controls": [...], "color": "Lit"}  Light while pressed.
+  {"type": "toggle", "controls": [...], "color": "Lit"}     Press toggles light on/off.
+  {"type": "radio", "controls": [...], "color": "Lit"}      Press lights one and turns the others off,
+                                                            pressing a lit one turns it off.
+  {"type": "follow", "source": "col1_slider", "target": "col1_select", "color": "Lit"}
+                                                            Light target while source is pressed or touched.
+Toggle and radio publish their state on faderport/<control>/event/state as 1 or 0. Their state follows lights set
+from elsewhere (ex. set_light over MQTT), a button turned off externally is turned on by the next press.
+"""
+RULE_TYPES = ["momentary", "toggle", "radio", "follow"]
+
+
+def _is_down(msg):
+    """
+    :return: True if msg presses or touches, False if released and None for other messages.
+    """
+    if msg.type == "note_on":
+        return msg.velocity > 0
+    elif msg.type == "note_off":
+        return False
+    elif msg.type == "control_change":
+        return msg.value > 0
+    return None
+
+
+class FeedbackRules:
+    def __init__(self, faderport, path: str = "", test_mode: bool = False):
+        """
+        Local feedback rules for a Faderport.
+        Can be set over MQTT on topic faderport/rules/set with rules in JSON as payload.
+        :param faderport: Faderport object owning the controls.
+        :param path: str JSON file with rules to load.
+        :param test_mode: bool add a momentary rule for all buttons, write control-values back so buttons light up.
+        """
+        self.name = "rules"
+        self.faderport = faderport
+        self.test_mode = test_mode
+        self.rules = []
+        # Toggle state per button
+        self.state = {}
+        # Buttons of toggle and radio rules, their state is synced when their light is set externally
+        self.stateful = set()
+        # Set while a reflex runs, lights set by rules aren't synced back into the state
+        self._local = threading.local()
+        # Compiled reflex per control object, reflex(msg)
+        self.reflexes = {}
+        if path:
+            self.load(path)
+
+    def load(self, path: str):
+        with open(path) as f:
+            self.set_rules(json.load(f))
+
+    def set_rules(self, rules):
+        """
+        Replace rules and compile them. Before the controls exist the rules are checked against a plain layout, so a
+        bad rules file fails when the bridge starts.
+        :param rules: list of rules, or dict with list of rules under "rules".
+        """
+        if type(rules) is dict:
+            rules = rules.get("rules", [])
+        if type(rules) is not list:
+            raise Exception(f"Rules must be a list, got {type(rules).__name__}.")
+        for rule in rules:
+            if type(rule) is not dict or rule.get("type") not in RULE_TYPES:
+                raise Exception(f"Rule {rule} must have a type of {RULE_TYPES}.")
+        if self.faderport.controls is None:
+            self._compile_reflexes(rules, FaderportControls())
+            self.rules = rules
+            return
+        self.reflexes, self.stateful = self._compile_reflexes(rules, self.faderport.controls)
+        self.rules = rules
+
+    def compile(self):
+        """
+        Compile rules into reflexes. Called when rules change and when the controls are created.
+        """
+        controls = self.faderport.controls
+        if controls is None:
+            return
+        self.reflexes, self.stateful = self._compile_reflexes(self.rules, controls)
+
+    def _compile_reflexes(self, rules: list, controls: FaderportControls) -> tuple:
+        """
+        :return: tuple of dict with reflex per control and set of buttons with a toggle or radio state.
+        """
+        if self.test_mode:
+            rules = [{"type": "momentary", "controls": "*"}] + rules
+        actions = {}
+        stateful = set()
+        for rule in rules:
+            if rule["type"] == "follow":
+                source = self._find_control(controls, rule.get("source"))
+                target = self._find_button(controls, rule.get("target"))
+                actions.setdefault(source, []).append(self._compile_momentary(target, rule.get("color")))
+                continue
+            buttons = self._find_buttons(controls, rule.get("controls"))
+            if rule["type"] == "momentary":
+                for button in buttons:
+                    actions.setdefault(button, []).append(self._compile_momentary(button, rule.get("color")))
+            elif rule["type"] == "toggle":
+                stateful.update(buttons)
+                for button in buttons:
+                    actions.setdefault(button, []).append(self._compile_toggle(button, rule.get("color")))
+            elif rule["type"] == "radio":
+                stateful.update(buttons)
+                colors = [self._parse_color(button, rule.get("color")) for button in buttons]
+                for button in buttons:
+                    actions.setdefault(button, []).append(self._compile_radio(button, buttons, colors))
+        reflexes = {control: self._compile_reflex(control_actions) for control, control_actions in actions.items()}
+        return reflexes, stateful
+
+    def _compile_reflex(self, actions: list):
+        local = self._local
+
+        def reflex(msg):
+            down = _is_down(msg)
+            if down is None:
+                return
+            local.running = True
+            try:
+                for action in actions:
+                    action(down)
+            finally:
+                local.running = False
+        return reflex
+
+    def _compile_momentary(self, button: Button, color):
+        on = self._parse_color(button, color)
+        off = ColorsSingle.Black.value
+
+        def momentary(down: bool):
+            button.set_light(on if down else off)
+        return momentary
+
+    def _compile_toggle(self, button: Button, color):
+        on = self._parse_color(button, color)
+
+        def toggle(down: bool):
+            if down:
+                self._set_state(button, on, not self.state.get(button.name, False))
+        return toggle
+
+    def _compile_radio(self, button: Button, buttons: list, colors: list):
+        on = colors[buttons.index(button)]
+        others = [(other, color) for other, color in zip(buttons, colors) if other is not button]
+
+        def radio(down: bool):
+            if not down:
+                return
+            if self.state.get(button.name, False):
+                self._set_state(button, on, False)
+                return
+            for other, other_on in others:
+                if self.state.get(other.name, False):
+                    self._set_state(other, other_on, False)
+            self._set_state(button, on, True)
+        return radio
+
+    def _set_state(self, button: Button, on, state: bool):
+        self.state[button.name] = state
+        button.set_light(on if state else ColorsSingle.Black.value)
+        self.faderport.events.publish(button, "state", 1 if state else 0)
+
+    def sync(self, button: Button, color):
+        """
+        Sync state of a toggle or radio button with a light set on it from outside the rules, called for every light
+        set on a button.
+        :param color: int color or 8-bit (red, green, blue) tuple sent to the button.
+        """
+        if button not in self.stateful or getattr(self._local, "running", False):
+            return
+        if type(color) is tuple:
+            self.state[button.name] = any(color)
+        else:
+            self.state[button.name] = color != ColorsSingle.Black.value
+
+    @staticmethod
+    def _parse_color(button: Button, color):
+        # Validate when compiling, reflexes run in the MIDI-loop
+        if color is None:
+            return ColorsSingle.Lit.value
+        if type(color) is int:
+            if color < 0 or color >= len(ColorsSingle.__members__):
+                raise Exception(f"Color {color} for {button.name} must be in range of 0 to "
+                                f"{len(ColorsSingle.__members__) - 1}.")
+            return color
+        if color in ColorsSingle.__members__:
+            return ColorsSingle[color].value
+        if button.luminance_type == LightTypes.RGB:
+            parse_rgb(str(color))
+            return str(color)
+        raise Exception(f"Color {color} is not valid for {button.name}.")
+
+    @staticmethod
+    def _find_control(controls: FaderportControls, name: str):
+        control = getattr(controls, str(name), None)
+        if control is None or control not in controls.elements:
+            raise Exception(f"Couldn't find control {name}.")
+        return control
+
+    def _find_button(self, controls: FaderportControls, name: str) -> Button:
+        control = self._find_control(controls, name)
+        if type(control) is not Button:
+            raise Exception(f"Control {name} is not a button.")
+        return control
+
+    def _find_buttons(self, controls: FaderportControls, names) -> list:
+        if names == "*":
+            return [element for element in controls.elements if type(element) is Button]
+        if type(names) is not list:
+            raise Exception(f"Controls {names} must be a list of names or *.")
+        return [self._find_button(controls, name) for name in names]
+
+    def callback_set_parse_mqtt(self, topics, control_object, msg):
+        try:
+            if topics[2] != "set":
+                print(f"callback_set_parse_mqtt() Couldn't parse topic {topics[2]}.")
+                return
+            payload = msg.payload.decode()
+            self.set_rules(json.loads(payload) if payload.strip() else [])
+        except Exception as ex:
+            self.faderport.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+
+    def __repr__(self):
+        out = f"FeedbackRules(rules={len(self.rules)}, test_mode={self.test_mode}, state={self.state}"
+        out += f")"
+        return out
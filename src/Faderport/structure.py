@@ -1,5 +1,7 @@
+import threading
 from Faderport.helper_functions import try_parse_int
 from Faderport.constants import *
+from Faderport.taper import FaderTaper, FaderTaperAudio, PITCH_MIN, PITCH_MAX
 
 
 class Button:
@@ -116,7 +118,7 @@ class Button:
 
 class PitchWheel:
     def __init__(self, name: str, cb_pitchwheel_set_pitch,
-                 channel: int, touch_id: int):
+                 channel: int, touch_id: int, taper: FaderTaper = None):
         self.name = name
         self.callback_pitchwheel_set_pitch = cb_pitchwheel_set_pitch
         self.pitchwheel_channel = channel
@@ -124,7 +126,14 @@ class PitchWheel:
         self.touch_midi_id = touch_id
         self.touch_midi_type = MIDIType.Note
         self.touch_channel = 0
+        self.taper = taper
         self.pitch = None
+        # While touched, set_pitch is deferred until release to not fight the user
+        self.touched = False
+        self.deferred_pitch = None
+        self.sends_suppressed = 0
+        self.sends_deferred = 0
+        self._touch_lock = threading.Lock()
 
     def set_pitch(self, pitch):
         """
@@ -147,19 +156,96 @@ class PitchWheel:
         else:
             raise Exception(f"Pitch argument {pitch_argument} is not valid for set_pitch().")
         # Validate ranges
-        if pitch_to_set < -8192 or pitch_to_set > 8191:
-            raise Exception(f"Pitch {pitch_to_set} must be in range of -8192 to 8191.")
-        if self.pitch == pitch_to_set:
-            # print(f"Pitch {pitch_to_set} is already set for {self.name}.")
-            return
-        # Send command
-        self.callback_pitchwheel_set_pitch(channel=self.pitchwheel_channel, pitch_value=pitch_to_set)
-        # Update state
-        self.pitch = pitch_to_set
+        if pitch_to_set < PITCH_MIN or pitch_to_set > PITCH_MAX:
+            raise Exception(f"Pitch {pitch_to_set} must be in range of {PITCH_MIN} to {PITCH_MAX}.")
+        with self._touch_lock:
+            if self.touched:
+                # Keep latest target, sent on release. Only count targets that would have been sent
+                previous = self.pitch if self.deferred_pitch is None else self.deferred_pitch
+                if pitch_to_set != previous:
+                    self.sends_suppressed += 1
+                self.deferred_pitch = pitch_to_set
+                return
+            if self.pitch == pitch_to_set:
+                # print(f"Pitch {pitch_to_set} is already set for {self.name}.")
+                return
+            # Send command under the lock, a release sending a deferred pitch meanwhile can't reorder the motor
+            self.callback_pitchwheel_set_pitch(channel=self.pitchwheel_channel, pitch_value=pitch_to_set)
+            # Update state
+            self.pitch = pitch_to_set
+
+    def set_touched(self, touched: bool):
+        """
+        Track touch of slider, on release a pitch deferred during touch is sent in one message.
+        :param touched: bool True on touch, False on release.
+        """
+        with self._touch_lock:
+            self.touched = touched
+            if touched or self.deferred_pitch is None:
+                return
+            pitch_to_set = self.deferred_pitch
+            self.deferred_pitch = None
+            if self.pitch == pitch_to_set:
+                return
+            self.callback_pitchwheel_set_pitch(channel=self.pitchwheel_channel, pitch_value=pitch_to_set)
+            self.pitch = pitch_to_set
+            self.sends_deferred += 1
+
+    @property
+    def sends_avoided(self) -> int:
+        """
+        Number of pitch messages not sent because the slider was touched.
+        """
+        return self.sends_suppressed - self.sends_deferred
+
+    def set_normalized(self, normalized):
+        """
+        Set slider to a normalized gain through the taper.
+        :param normalized: float 0.0 (off) to 1.0 (top), values outside are clamped.
+        """
+        self.set_pitch(self.taper.normalized_to_pitch(self._parse_float(normalized)))
+
+    def set_db(self, db):
+        """
+        Set slider to a level in dB through the taper.
+        :param db: float level in dB, '-inf' sets the slider to the bottom.
+        """
+        self.set_pitch(self.taper.db_to_pitch(self._parse_float(db)))
+
+    @property
+    def normalized(self):
+        if self.pitch is None:
+            return None
+        return self.taper.pitch_to_normalized_table[self.pitch - PITCH_MIN]
+
+    @property
+    def db(self):
+        if self.pitch is None:
+            return None
+        return self.taper.pitch_to_db_table[self.pitch - PITCH_MIN]
+
+    @staticmethod
+    def _parse_float(value) -> float:
+        if type(value) is float or type(value) is int:
+            value_to_set = float(value)
+        elif type(value) is bytes or type(value) is str:
+            # Convert bytes to str
+            if type(value) is bytes:
+                value = value.decode()
+            try:
+                value_to_set = float(value)
+            except ValueError:
+                raise Exception(f"Argument {value} can't be parsed as float.")
+        else:
+            raise Exception(f"Argument {value} is not valid, must be a float.")
+        if value_to_set != value_to_set:
+            raise Exception(f"Argument {value} is not a number.")
+        return value_to_set
 
     def __repr__(self):
         out = f"PitchWheel(name='{self.name}', " \
-              f"channel={self.pitchwheel_channel}"
+              f"channel={self.pitchwheel_channel}, taper={self.taper}, " \
+              f"touched={self.touched}, sends_avoided={self.sends_avoided}"
         out += f")"
         return out
 
@@ -179,12 +265,15 @@ class Knob:
 
 
 class FaderportControls:
-    def __init__(self):
+    def __init__(self, taper: FaderTaper = None):
         self.mqtt_prefix = "faderport"
         self.mqtt_topics_in = {}
         self.mqtt_topics_out = {}
         self.midi_triggers = {}
         self.elements = []
+        # Faders share one compiled taper unless set per slider
+        if taper is None:
+            taper = FaderTaperAudio()
         # Left Knob
         self.add_control_knob(knob=Knob(name="left_knob", midi_touch=32, midi_rotate=16))
         # Left buttons
@@ -324,7 +413,7 @@ class FaderportControls:
                                                midi_id=8+i, luminance_type=LightTypes.Yellow))
             self.add_control_pitch_wheel(pitchwheel=PitchWheel(name=f"col{col}_slider",
                                                                cb_pitchwheel_set_pitch=self.callback_unset,
-                                                               channel=i, touch_id=104+i))
+                                                               channel=i, touch_id=104+i, taper=taper))
 
     def callback_unset(*args, **kwargs):
         raise Exception(f"Callback is not set for {args} {kwargs}.")
@@ -335,10 +424,14 @@ class FaderportControls:
             raise Exception(f"Control {btn.name} already exist in mqtt_topics_in.")
         self.mqtt_topics_in[btn.name] = {}
         self.mqtt_topics_in[btn.name]["set_light"] = (btn, self.callback_unset)
+        if btn.luminance_type == LightTypes.RGB:
+            self.mqtt_topics_in[btn.name]["set_meter"] = (btn, self.callback_unset)
+            self.mqtt_topics_in[btn.name]["set_animation"] = (btn, self.callback_unset)
         # Topics Out
         self.mqtt_topics_out[btn.name] = {}
         self.mqtt_topics_out[btn.name]["event/down"] = (btn, self.callback_unset)
         self.mqtt_topics_out[btn.name]["event/up"] = (btn, self.callback_unset)
+        self.mqtt_topics_out[btn.name]["event/state"] = (btn, self.callback_unset)
         # MIDI Triggers
         # Set midi_triggers[channel][midi_id][type] = (button_object, button_callback)
         if btn.channel not in self.midi_triggers:
@@ -360,11 +453,15 @@ class FaderportControls:
             raise Exception(f"Control {pitchwheel.name} already exist in mqtt_topics_in.")
         self.mqtt_topics_in[pitchwheel.name] = {}
         self.mqtt_topics_in[pitchwheel.name]["set_pitch"] = (pitchwheel, self.callback_unset)
+        self.mqtt_topics_in[pitchwheel.name]["set_normalized"] = (pitchwheel, self.callback_unset)
+        self.mqtt_topics_in[pitchwheel.name]["set_db"] = (pitchwheel, self.callback_unset)
         # Topics Out
         self.mqtt_topics_out[pitchwheel.name] = {}
         self.mqtt_topics_out[pitchwheel.name]["event/touch"] = (pitchwheel, self.callback_unset)
         self.mqtt_topics_out[pitchwheel.name]["event/release"] = (pitchwheel, self.callback_unset)
         self.mqtt_topics_out[pitchwheel.name]["event/pitch"] = (pitchwheel, self.callback_unset)
+        self.mqtt_topics_out[pitchwheel.name]["event/normalized"] = (pitchwheel, self.callback_unset)
+        self.mqtt_topics_out[pitchwheel.name]["event/db"] = (pitchwheel, self.callback_unset)
         # MIDI Triggers
         # Set midi_triggers[channel][midi_id][type] = (button_object, button_callback)
         if pitchwheel.pitchwheel_channel not in self.midi_triggers:
@@ -407,10 +504,13 @@ class FaderportControls:
 
 
 class FaderportControlsMidi2MQTT(FaderportControls):
-    def __init__(self, faderport):
-        super(FaderportControlsMidi2MQTT, self).__init__()
+    def __init__(self, faderport, taper: FaderTaper = None):
+        super(FaderportControlsMidi2MQTT, self).__init__(taper=taper)
         self.faderport = faderport
-        self.mqtt_client = self.faderport.mqtt_client
+        self.transport = self.faderport.transport
+        self.events = self.faderport.events
+        # Precompiled topics, mqtt_topics_event[control_object][kind] = topic
+        self.mqtt_topics_event = {}
 
         # Set callbacks for all elements
         for element in self.elements:
@@ -419,6 +519,9 @@ class FaderportControlsMidi2MQTT(FaderportControls):
                 element.callback_set_light = self.callback_button_set_light
                 # Topics In
                 self.mqtt_topics_in[element.name]["set_light"] = (element, self.callback_button_set_light_parse_mqtt)
+                if element.luminance_type == LightTypes.RGB:
+                    self.mqtt_topics_in[element.name]["set_meter"] = (element, self.faderport.lights.callback_button_set_animation_parse_mqtt)
+                    self.mqtt_topics_in[element.name]["set_animation"] = (element, self.faderport.lights.callback_button_set_animation_parse_mqtt)
                 # MIDI Triggers
                 if element.midi_type == MIDIType.ControlChange:
                     self.midi_triggers[element.channel][element.midi_id]['control_change'] = (element, self.callback_button_event_parse_midi)
@@ -430,6 +533,8 @@ class FaderportControlsMidi2MQTT(FaderportControls):
                 element.callback_pitchwheel_set_pitch = self.callback_pitch_wheel_set_pitch
                 # Topics In
                 self.mqtt_topics_in[element.name]["set_pitch"] = (element, self.callback_pitch_wheel_set_pitch_parse_mqtt)
+                self.mqtt_topics_in[element.name]["set_normalized"] = (element, self.callback_pitch_wheel_set_pitch_parse_mqtt)
+                self.mqtt_topics_in[element.name]["set_db"] = (element, self.callback_pitch_wheel_set_pitch_parse_mqtt)
                 # MIDI Triggers
                 self.midi_triggers[element.touch_channel][element.touch_midi_id]['note_on'] = (element, self.callback_pitch_wheel_event_parse_midi)
                 self.midi_triggers[element.touch_channel][element.touch_midi_id]['note_off'] = (element, self.callback_pitch_wheel_event_parse_midi)
@@ -439,30 +544,41 @@ class FaderportControlsMidi2MQTT(FaderportControls):
                 self.midi_triggers[element.midi_channel][element.midi_touch]['note_on'] = (element, self.callback_knob_event_parse_midi)
                 self.midi_triggers[element.midi_channel][element.midi_touch]['note_off'] = (element, self.callback_knob_event_parse_midi)
                 self.midi_triggers[element.midi_channel][element.midi_rotate]['control_change'] = (element, self.callback_knob_event_parse_midi)
+            # Topics Out
+            self.mqtt_topics_event[element] = {}
+            for topic in self.mqtt_topics_out[element.name]:
+                self.mqtt_topics_event[element][topic.split("/")[-1]] = f"{self.mqtt_prefix}/{element.name}/{topic}"
+        # MQTT is a subscriber of all events. Topics of taper conversions are published with the pitch they were
+        # converted from, not from events of their own
+        kinds = {topic.split("/")[-1] for topics in self.mqtt_topics_out.values() for topic in topics}
+        self.events.subscribe("*", self.callback_event_publish_mqtt, kinds=sorted(kinds - {"normalized", "db"}))
 
     def callback_button_set_light(self, button: Button, color_to_set):
         self.faderport.button_set_color(button, color_to_set)
 
+    def callback_event_publish_mqtt(self, event):
+        topics = self.mqtt_topics_event[event.control]
+        self.transport.publish(topic=topics[event.kind], payload=f"{event.value}")
+        if event.kind == "pitch":
+            # Taper conversions are precompiled, look up payloads by the pitch of the event
+            index = event.value - PITCH_MIN
+            self.transport.publish(topic=topics["normalized"],
+                                   payload=event.control.taper.pitch_to_normalized_payload[index])
+            self.transport.publish(topic=topics["db"], payload=event.control.taper.pitch_to_db_payload[index])
+
     def callback_button_event_parse_midi(self, control_object, msg):
         if msg.type == "control_change":
-            if msg.value > 0:
-                payload = f"{msg.value}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/down"
-            else:
-                payload = f"{msg.value}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/up"
+            value = msg.value
+            kind = "down" if msg.value > 0 else "up"
         elif msg.type == "note_on":
-            payload = f"{msg.velocity}"
-            if msg.velocity == 0:
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/up"
-            else:
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/down"
+            value = msg.velocity
+            kind = "up" if msg.velocity == 0 else "down"
         elif msg.type == "note_off":
-            payload = f"{msg.velocity}"
-            topic = f"{self.mqtt_prefix}/{control_object.name}/event/up"
+            value = msg.velocity
+            kind = "up"
         else:
             return
-        self.mqtt_client.publish(topic=topic, payload=payload)
+        self.events.publish(control_object, kind, value)
 
     def callback_button_set_light_parse_mqtt(self, topics, control_object, msg):
         # print(f"callback_display for {control_object.name} msg {topics} {msg.payload}")
@@ -473,58 +589,64 @@ class FaderportControlsMidi2MQTT(FaderportControls):
                 print(f"callback_button_set_light() Couldn't parse topic {topics[2]}.")
                 return
         except Exception as ex:
-            self.mqtt_client.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+            self.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
 
     def callback_pitch_wheel_set_pitch(self, channel: int, pitch_value: int):
         self.faderport.send_pitch_wheel(channel, pitch_value)
 
     def callback_pitch_wheel_event_parse_midi(self, control_object, msg):
         if msg.type == "note_on":
-            payload = f"{msg.velocity}"
+            value = msg.velocity
             if msg.velocity == 0:
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/release"
+                kind = "release"
+                control_object.set_touched(False)
             else:
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/touch"
+                kind = "touch"
+                control_object.set_touched(True)
         elif msg.type == "note_off":
-            payload = f"{msg.velocity}"
-            topic = f"{self.mqtt_prefix}/{control_object.name}/event/release"
+            value = msg.velocity
+            kind = "release"
+            control_object.set_touched(False)
         elif msg.type == "pitchwheel":
-            payload = f"{msg.pitch}"
-            topic = f"{self.mqtt_prefix}/{control_object.name}/event/pitch"
             control_object.pitch = msg.pitch
+            # Taper conversions are events of their own, looked up in the precompiled tables
+            index = msg.pitch - PITCH_MIN
+            self.events.publish(control_object, "pitch", msg.pitch)
+            self.events.publish(control_object, "normalized", control_object.taper.pitch_to_normalized_table[index])
+            self.events.publish(control_object, "db", control_object.taper.pitch_to_db_table[index])
+            return
         else:
             return
-        self.mqtt_client.publish(topic=topic, payload=payload)
+        self.events.publish(control_object, kind, value)
 
     def callback_pitch_wheel_set_pitch_parse_mqtt(self, topics, control_object, msg):
         # print(f"callback_pitch_wheel_set_pitch for {control_object.name} msg {topics} {msg.payload}")
         try:
             if topics[2] == "set_pitch":
                 control_object.set_pitch(msg.payload)
+            elif topics[2] == "set_normalized":
+                control_object.set_normalized(msg.payload)
+            elif topics[2] == "set_db":
+                control_object.set_db(msg.payload)
             else:
                 print(f"callback_pitch_wheel_set_pitch() Couldn't parse topic {topics[2]}.")
                 return
         except Exception as ex:
-            self.mqtt_client.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
+            self.transport.publish(topic=f"{topics[0]}/{topics[1]}/error", payload=str(ex))
 
     def callback_knob_event_parse_midi(self, control_object, msg):
         if msg.type == "control_change":
+            kind = "rotate"
             if msg.value > 0 and msg.value < 64:
-                payload = f"{msg.value}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/rotate"
+                value = msg.value
             else:
-                payload = f"{(msg.value-64) * -1}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/rotate"
+                value = (msg.value-64) * -1
         elif msg.type == "note_on":
-            if msg.velocity == 0:
-                payload = f"{msg.velocity}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/up"
-            else:
-                payload = f"{msg.velocity}"
-                topic = f"{self.mqtt_prefix}/{control_object.name}/event/down"
+            value = msg.velocity
+            kind = "up" if msg.velocity == 0 else "down"
         else:
             return
-        self.mqtt_client.publish(topic=topic, payload=payload)
+        self.events.publish(control_object, kind, value)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+from bisect import bisect_left
+from math import log10
+
+"""
+Fader tapers map the raw 14-bit pitch of a motor fader (-8192 to 8191) to a normalized gain (0.0 to 1.0) and a
+level in dB. Every taper is compiled into lookup tables when created, so a conversion on the MIDI- and MQTT-paths
+is a list index or a bisect of a table and never evaluates the curve.
+
+normalized is the linear gain relative to the top of the fader, 1.0 at max_db and 0.0 when the fader is off.
+"""
+PITCH_MIN = -8192
+PITCH_MAX = 8191
+PITCH_STEPS = 16384
+
+
+class FaderTaper:
+    def __init__(self, name: str, min_db: float = -60.0, max_db: float = 10.0):
+        """
+        Base class of a fader taper, subclasses implement position_to_db().
+        :param name: str name of taper, used in repr.
+        :param min_db: float lowest level in dB before the fader is off, lower levels set the fader to the bottom.
+        :param max_db: float level in dB at the top of the fader.
+        """
+        if min_db >= max_db:
+            raise Exception(f"Taper min_db {min_db} must be less than max_db {max_db}.")
+        self.name = name
+        self.min_db = min_db
+        self.max_db = max_db
+        # Tables from pitch, index with pitch - PITCH_MIN. Pitch from a value is a bisect of the same rising tables
+        self.pitch_to_normalized_table = []
+        self.pitch_to_db_table = []
+        self.pitch_to_normalized_payload = []
+        self.pitch_to_db_payload = []
+        self.compile()
+
+    def position_to_db(self, position: float) -> float:
+        """
+        Taper curve, override in subclass.
+        :param position: float fader position from 0.0 (bottom) to 1.0 (top).
+        :return: float level in dB, float('-inf') when the fader is off.
+        """
+        raise Exception(f"Taper {self.name} doesn't implement position_to_db().")
+
+    def compile(self):
+        """
+        Compile the lookup tables. Call again if the curve is changed.
+        """
+        normalized_table = []
+        db_table = []
+        for i in range(PITCH_STEPS):
+            db = self.position_to_db(i / (PITCH_STEPS - 1))
+            if db == float('-inf'):
+                normalized = 0.0
+            else:
+                normalized = 10 ** ((db - self.max_db) / 20)
+            if db_table and (db < db_table[-1] or normalized < normalized_table[-1]):
+                raise Exception(f"Taper {self.name} must be rising, position {i / (PITCH_STEPS - 1)} falls.")
+            normalized_table.append(normalized)
+            db_table.append(db)
+        self.pitch_to_normalized_table = normalized_table
+        self.pitch_to_db_table = db_table
+        self.pitch_to_normalized_payload = [f"{normalized:.4f}" for normalized in normalized_table]
+        self.pitch_to_db_payload = [f"{db:.2f}" for db in db_table]
+
+    def pitch_to_normalized(self, pitch: int) -> float:
+        return self.pitch_to_normalized_table[pitch - PITCH_MIN]
+
+    def pitch_to_db(self, pitch: int) -> float:
+        return self.pitch_to_db_table[pitch - PITCH_MIN]
+
+    def normalized_to_pitch(self, normalized: float) -> int:
+        """
+        Look up the pitch with the nearest normalized gain.
+        :param normalized: float 0.0 to 1.0, values outside are clamped.
+        """
+        if normalized <= 0.0:
+            return PITCH_MIN
+        return self._nearest_pitch(self.pitch_to_normalized_table, normalized)
+
+    def db_to_pitch(self, db: float) -> int:
+        """
+        Look up the pitch with the nearest level in dB.
+        :param db: float level, below min_db sets the fader to the bottom, above max_db to the top.
+        """
+        if db < self.min_db:
+            return PITCH_MIN
+        return self._nearest_pitch(self.pitch_to_db_table, db)
+
+    @staticmethod
+    def _nearest_pitch(table: list, value: float) -> int:
+        # Bisect the rising table, the resolution of the lookup is the resolution of the fader at every level
+        index = bisect_left(table, value)
+        if index >= PITCH_STEPS:
+            return PITCH_MAX
+        if index > 0 and value - table[index - 1] < table[index] - value:
+            index -= 1
+        return index + PITCH_MIN
+
+    def __repr__(self):
+        out = f"{type(self).__name__}(name='{self.name}', min_db={self.min_db}, max_db={self.max_db}"
+        out += f")"
+        return out
+
+
+class FaderTaperLinear(FaderTaper):
+    def __init__(self, min_db: float = -60.0, max_db: float = 10.0):
+        """
+        Gain is linear to the fader position. Positions below min_db are off.
+        """
+        super(FaderTaperLinear, self).__init__(name="linear", min_db=min_db, max_db=max_db)
+
+    def position_to_db(self, position: float) -> float:
+        if position <= 0.0:
+            return float('-inf')
+        db = self.max_db + 20 * log10(position)
+        # Levels that db_to_pitch can't set back are off, echoing a published level keeps the fader in place
+        if db < self.min_db:
+            return float('-inf')
+        return db
+
+
+class FaderTaperAudio(FaderTaper):
+    def __init__(self, min_db: float = -60.0, max_db: float = 10.0):
+        """
+        Audio log taper, dB is linear to the fader position from min_db to max_db. The bottom of the fader is off.
+        """
+        super(FaderTaperAudio, self).__init__(name="audio", min_db=min_db, max_db=max_db)
+
+    def position_to_db(self, position: float) -> float:
+        if position <= 0.0:
+            return float('-inf')
+        return self.min_db + position * (self.max_db - self.min_db)
+
+
+class FaderTaperBreakpoints(FaderTaper):
+    def __init__(self, breakpoints: list, name: str = "breakpoints"):
+        """
+        Custom taper, dB is interpolated linearly between breakpoints.
+        :param breakpoints: list of (position, dB) tuples, position from 0.0 to 1.0 in rising order.
+                            Ex. [(0.0, float('-inf')), (0.25, -40.0), (0.75, 0.0), (1.0, 10.0)]
+        :param name: str name of taper.
+        """
+        if len(breakpoints) < 2:
+            raise Exception(f"Taper {name} needs at least two breakpoints.")
+        positions = [float(point[0]) for point in breakpoints]
+        if positions[0] != 0.0 or positions[-1] != 1.0:
+            raise Exception(f"Taper {name} breakpoints must start at position 0.0 and end at 1.0.")
+        for a, b in zip(positions, positions[1:]):
+            if b <= a:
+                raise Exception(f"Taper {name} breakpoint positions must be rising, {b} after {a}.")
+        self.breakpoint_positions = positions
+        self.breakpoint_dbs = [float(point[1]) for point in breakpoints]
+        # Lowest finite level is min_db
+        finite_dbs = [db for db in self.breakpoint_dbs if db != float('-inf')]
+        if len(finite_dbs) < 2:
+            raise Exception(f"Taper {name} needs at least two finite levels in dB.")
+        super(FaderTaperBreakpoints, self).__init__(name=name, min_db=finite_dbs[0], max_db=self.breakpoint_dbs[-1])
+
+    def position_to_db(self, position: float) -> float:
+        index = bisect_left(self.breakpoint_positions, position)
+        if index == 0:
+            return self.breakpoint_dbs[0]
+        if index >= len(self.breakpoint_positions):
+            return self.breakpoint_dbs[-1]
+        position_a = self.breakpoint_positions[index - 1]
+        position_b = self.breakpoint_positions[index]
+        db_a = self.breakpoint_dbs[index - 1]
+        db_b = self.breakpoint_dbs[index]
+        if db_a == float('-inf'):
+            # Off until the next breakpoint
+            return db_b if position == position_b else db_a
+        return db_a + (position - position_a) / (position_b - position_a) * (db_b - db_a)
+
+
+TAPERS = {
+    "linear": FaderTaperLinear,
+    "audio": FaderTaperAudio,
+}
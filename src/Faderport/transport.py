@@ -0,0 +1,373 @@
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+import paho.mqtt.client as mqtt
+
+"""
+Transports carry topic/payload messages between the controls and the consumers.
+MQTTTransport goes through a MQTT broker. LocalTransport is broker-less over a Unix domain socket for consumers on the
+same machine, with the same topics, payloads and wildcard subscriptions. Consumers connect with LocalClient which
+mimics the parts of paho.mqtt.client.Client in use (connect, subscribe, publish, on_message, loop_start).
+
+Callbacks on_connect(client, userdata, flags, rc) and on_message(client, userdata, msg) have the same signatures as
+paho, msg has the attributes topic (str) and payload (bytes).
+"""
+LOCAL_PATH_DEFAULT = "/tmp/faderport.sock"
+# Frames queued per consumer before a consumer that doesn't read is disconnected
+LOCAL_QUEUE_SIZE = 1024
+# Topics with cached subscribers, consumers can publish any topic so the cache is cleared when full
+LOCAL_MATCHES_SIZE = 4096
+
+# Frame header: kind, topic length, payload length
+_FRAME_HEADER = struct.Struct("!BHI")
+_FRAME_PUBLISH = 1
+_FRAME_SUBSCRIBE = 2
+_FRAME_UNSUBSCRIBE = 3
+
+
+def topic_matches(subscription: str, topic: str) -> bool:
+    """
+    Match a topic against a MQTT subscription with wildcards + and #.
+    """
+    subscription_levels = subscription.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(subscription_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(subscription_levels) == len(topic_levels)
+
+
+class LocalMessage:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+    def __repr__(self):
+        return f"LocalMessage(topic='{self.topic}', payload={self.payload})"
+
+
+class Transport:
+    def __init__(self):
+        """
+        Base class of a transport. Set on_connect and on_message before start().
+        """
+        self.on_connect = None
+        self.on_message = None
+
+    def start(self):
+        raise Exception(f"Transport {type(self).__name__} doesn't implement start().")
+
+    def stop(self):
+        pass
+
+    def subscribe(self, topic: str):
+        raise Exception(f"Transport {type(self).__name__} doesn't implement subscribe().")
+
+    def publish(self, topic: str, payload):
+        raise Exception(f"Transport {type(self).__name__} doesn't implement publish().")
+
+
+class MQTTTransport(Transport):
+    def __init__(self, host: str = "127.0.0.1"):
+        """
+        Transport over a MQTT broker.
+        :param host: str host of MQTT broker.
+        """
+        super(MQTTTransport, self).__init__()
+        self.host = host
+        self.client = mqtt.Client()
+
+    def start(self):
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(host=self.host)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.loop_stop()
+
+    def subscribe(self, topic: str):
+        self.client.subscribe(topic)
+
+    def publish(self, topic: str, payload):
+        self.client.publish(topic=topic, payload=payload)
+
+    def __repr__(self):
+        return f"MQTTTransport(host='{self.host}')"
+
+
+class _LocalConnection:
+    def __init__(self, sock: socket.socket, queue_size: int = 0):
+        """
+        Framed connection over a Unix domain socket.
+        :param queue_size: int frames to queue for a writer thread, send() never blocks and raises OSError when the
+                           queue is full. Sends block the caller if 0.
+        """
+        self.sock = sock
+        self.subscriptions = []
+        self.closed = False
+        self._send_lock = threading.Lock()
+        self._queue = None
+        if queue_size > 0:
+            self._queue = queue.Queue(maxsize=queue_size)
+            threading.Thread(target=self._write, daemon=True).start()
+
+    def send(self, frame: bytes):
+        if self._queue is None:
+            with self._send_lock:
+                self.sock.sendall(frame)
+            return
+        if self.closed:
+            raise OSError("Connection is closed.")
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            raise OSError(f"Consumer isn't reading, {self._queue.maxsize} frames queued.")
+
+    def _write(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                self.close()
+                return
+
+    def send_frame(self, kind: int, topic: str, payload: bytes = b""):
+        self.send(_pack_frame(kind, topic, payload))
+
+    def receive_frame(self):
+        """
+        Block until a frame is received.
+        :return: tuple (kind, topic, payload) or None if connection is closed.
+        """
+        header = self._receive_exact(_FRAME_HEADER.size)
+        if header is None:
+            return None
+        kind, topic_length, payload_length = _FRAME_HEADER.unpack(header)
+        data = self._receive_exact(topic_length + payload_length)
+        if data is None:
+            return None
+        return kind, data[:topic_length].decode(), data[topic_length:]
+
+    def _receive_exact(self, length: int):
+        data = b""
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def close(self):
+        self.closed = True
+        if self._queue is not None:
+            # Wake writer thread, if the queue is full it exits on the closed socket
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def _pack_frame(kind: int, topic: str, payload) -> bytes:
+    if type(payload) is str:
+        payload = payload.encode()
+    topic_bytes = topic.encode()
+    return _FRAME_HEADER.pack(kind, len(topic_bytes), len(payload)) + topic_bytes + payload
+
+
+class LocalTransport(Transport):
+    def __init__(self, path: str = LOCAL_PATH_DEFAULT):
+        """
+        Broker-less transport over a Unix domain socket, the bridge acts as broker for local consumers.
+        :param path: str path of Unix domain socket.
+        """
+        super(LocalTransport, self).__init__()
+        if not hasattr(socket, "AF_UNIX"):
+            raise Exception(f"LocalTransport needs Unix domain sockets, not available on this platform.")
+        self.path = path
+        self.subscriptions = []
+        self.connections = []
+        self.server = None
+        self.quit = False
+        # Cache of topic -> list of subscribed connections, cleared when subscriptions change
+        self._matches = {}
+        self._lock = threading.Lock()
+        # Messages from consumers are received in one thread per connection, dispatch one at a time like paho
+        self._dispatch_lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                raise Exception(f"Path {self.path} exists and is not a socket.")
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def stop(self):
+        self.quit = True
+        with self._lock:
+            connections = self.connections
+            self.connections = []
+            self._matches = {}
+        for connection in connections:
+            connection.close()
+        if self.server:
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def subscribe(self, topic: str):
+        self.subscriptions.append(topic)
+
+    def publish(self, topic: str, payload):
+        connections = self._matches.get(topic)
+        if connections is None:
+            connections = self._match_connections(topic)
+        if not connections:
+            return
+        frame = _pack_frame(_FRAME_PUBLISH, topic, payload)
+        for connection in connections:
+            try:
+                connection.send(frame)
+            except OSError:
+                self._remove_connection(connection)
+
+    def _match_connections(self, topic: str) -> list:
+        with self._lock:
+            connections = [connection for connection in self.connections
+                           if any(topic_matches(subscription, topic) for subscription in connection.subscriptions)]
+            if len(self._matches) >= LOCAL_MATCHES_SIZE:
+                self._matches = {}
+            self._matches[topic] = connections
+        return connections
+
+    def _remove_connection(self, connection: _LocalConnection):
+        with self._lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            self._matches = {}
+        connection.close()
+
+    def _accept(self):
+        while not self.quit:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            # Sends are queued, a consumer that doesn't read can't block the MIDI-loop or other consumers
+            connection = _LocalConnection(sock, queue_size=LOCAL_QUEUE_SIZE)
+            with self._lock:
+                self.connections.append(connection)
+            threading.Thread(target=self._receive, args=(connection,), daemon=True).start()
+
+    def _receive(self, connection: _LocalConnection):
+        while not self.quit:
+            try:
+                frame = connection.receive_frame()
+            except OSError:
+                frame = None
+            if frame is None:
+                self._remove_connection(connection)
+                return
+            kind, topic, payload = frame
+            if kind == _FRAME_SUBSCRIBE:
+                with self._lock:
+                    connection.subscriptions.append(topic)
+                    self._matches = {}
+            elif kind == _FRAME_UNSUBSCRIBE:
+                with self._lock:
+                    if topic in connection.subscriptions:
+                        connection.subscriptions.remove(topic)
+                    self._matches = {}
+            elif kind == _FRAME_PUBLISH:
+                # Forward to other consumers like a broker, then to the bridge
+                self.publish(topic, payload)
+                if self.on_message and any(topic_matches(subscription, topic)
+                                           for subscription in self.subscriptions):
+                    with self._dispatch_lock:
+                        self.on_message(self, None, LocalMessage(topic, payload))
+
+    def __repr__(self):
+        return f"LocalTransport(path='{self.path}', connections={len(self.connections)})"
+
+
+class LocalClient:
+    def __init__(self):
+        """
+        Consumer of a LocalTransport, a drop-in for the used parts of paho.mqtt.client.Client.
+        """
+        self.on_connect = None
+        self.on_message = None
+        self.connection = None
+        self._thread = None
+
+    def connect(self, path: str = LOCAL_PATH_DEFAULT):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.connection = _LocalConnection(sock)
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic: str):
+        self.connection.send_frame(_FRAME_SUBSCRIBE, topic)
+
+    def unsubscribe(self, topic: str):
+        self.connection.send_frame(_FRAME_UNSUBSCRIBE, topic)
+
+    def publish(self, topic: str, payload=b""):
+        self.connection.send_frame(_FRAME_PUBLISH, topic, payload)
+
+    def loop_start(self):
+        self._thread = threading.Thread(target=self.loop_forever, daemon=True)
+        self._thread.start()
+
+    def loop_forever(self):
+        while True:
+            try:
+                frame = self.connection.receive_frame()
+            except OSError:
+                return
+            if frame is None:
+                return
+            kind, topic, payload = frame
+            if kind == _FRAME_PUBLISH and self.on_message:
+                self.on_message(self, None, LocalMessage(topic, payload))
+
+    def loop_stop(self):
+        self.disconnect()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def disconnect(self):
+        if self.connection:
+            try:
+                self.connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.connection.close()
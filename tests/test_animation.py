@@ -0,0 +1,166 @@
+import pytest
+from Faderport.animation import BLACK, GRADIENT_STEPS, ChaseAnimation, LightEngine, MeterAnimation, \
+    PulseAnimation, compile_gradient, parse_rgb
+from Faderport.constants import LightTypes
+from Faderport.structure import Button, FaderportControls
+
+
+class StubFaderport:
+    def __init__(self):
+        self.controls = FaderportControls()
+        self.lights = LightEngine(faderport=self)
+        self.notes = []
+
+    def send_note_on(self, channel: int, note: int, velocity: int):
+        self.notes.append((channel, note, velocity))
+
+
+@pytest.fixture
+def fp():
+    return StubFaderport()
+
+
+def test_compile_gradient():
+    table = compile_gradient([(0, 0, 0), (255, 255, 255)])
+    assert len(table) == GRADIENT_STEPS
+    assert table[0] == (0, 0, 0)
+    assert table[-1] == (127, 127, 127)
+    assert table[64] == (64, 64, 64)
+    for a, b in zip(table, table[1:]):
+        assert b[0] >= a[0]
+
+
+def test_compile_gradient_stops():
+    table = compile_gradient([(0, 0, 0), (0, 255, 0), (255, 0, 0)], steps=5)
+    assert table == [(0, 0, 0), (0, 64, 0), (0, 127, 0), (64, 64, 0), (127, 0, 0)]
+    with pytest.raises(Exception):
+        compile_gradient([(255, 0, 0)])
+
+
+@pytest.mark.parametrize("argument", ["255,0", "255,0,0,0", "a,b,c", "256,0,0", "-1,0,0"])
+def test_parse_rgb_errors(argument):
+    with pytest.raises(Exception):
+        parse_rgb(argument)
+
+
+def test_parse_rgb():
+    assert parse_rgb("255,127,0") == (255, 127, 0)
+
+
+@pytest.mark.parametrize("level", [float('nan'), float('inf'), -0.1])
+def test_meter_level_validation(fp, level):
+    with pytest.raises(Exception):
+        fp.lights.meter(fp.controls.col1_select, level)
+    assert fp.lights.animations == []
+
+
+@pytest.mark.parametrize("period", [0, -1.0, float('nan'), float('inf')])
+def test_period_validation(fp, period):
+    with pytest.raises(Exception):
+        fp.lights.pulse([fp.controls.col1_select], (255, 0, 0), period)
+    with pytest.raises(Exception):
+        fp.lights.chase([fp.controls.col1_select], (255, 0, 0), period)
+    assert fp.lights.animations == []
+
+
+def test_only_rgb_buttons(fp):
+    with pytest.raises(Exception):
+        fp.lights.meter(fp.controls.col1_mute, 0.5)
+
+
+def test_meter_render(fp):
+    button = fp.controls.col1_select
+    meter = fp.lights.meter(button, 0.0)
+    frame = {}
+    meter.render(0.0, frame)
+    assert frame == {button: meter.table[0]}
+    assert fp.lights.meter(button, 1.5) is meter
+    meter.render(0.0, frame)
+    assert frame == {button: meter.table[-1]}
+    assert len(fp.lights.animations) == 1
+
+
+def test_send_only_changed_components(fp):
+    button = fp.controls.col1_select
+    fp.lights._send(button, (10, 20, 30))
+    assert fp.notes == [(button.channel + 1, button.midi_id, 10), (button.channel + 2, button.midi_id, 20),
+                        (button.channel + 3, button.midi_id, 30)]
+    fp.notes.clear()
+    fp.lights._send(button, (10, 20, 30))
+    assert fp.notes == []
+    fp.lights._send(button, (10, 25, 30))
+    assert fp.notes == [(button.channel + 2, button.midi_id, 25)]
+
+
+def test_render_sends_changes(fp):
+    button = fp.controls.col1_select
+    fp.lights.meter(button, 1.0)
+    fp.lights.render(0.0)
+    assert len(fp.notes) == 3
+    fp.lights.render(0.0)
+    assert len(fp.notes) == 3
+
+
+def test_chase_render(fp):
+    buttons = [fp.controls.col1_select, fp.controls.col2_select]
+    chase = fp.lights.chase(buttons, (255, 0, 0), period=1.0)
+    frame = {}
+    chase.render(chase.start + 0.25, frame)
+    assert frame == {buttons[0]: (127, 0, 0), buttons[1]: BLACK}
+    chase.render(chase.start + 0.75, frame)
+    assert frame == {buttons[0]: BLACK, buttons[1]: (127, 0, 0)}
+
+
+def test_add_takes_over_buttons(fp):
+    buttons = [fp.controls.col1_select, fp.controls.col2_select]
+    pulse = fp.lights.pulse(buttons, (255, 0, 0))
+    meter = fp.lights.meter(buttons[0], 0.5)
+    assert pulse.buttons == [buttons[1]]
+    assert fp.lights.animations == [pulse, meter]
+    fp.lights.meter(buttons[1], 0.5)
+    assert pulse not in fp.lights.animations
+
+
+def test_release_keeps_light(fp):
+    button = fp.controls.col1_select
+    fp.lights.meter(button, 1.0)
+    fp.lights.render(0.0)
+    fp.notes.clear()
+    fp.lights.release([button])
+    assert fp.lights.animations == []
+    assert button not in fp.lights.sent
+    fp.lights.render(0.0)
+    assert fp.notes == []
+
+
+def test_release_before_first_frame(fp):
+    button = fp.controls.col1_select
+    fp.lights.pulse([button], (255, 0, 0))
+    fp.lights.release([button])
+    fp.lights.render(0.0)
+    assert fp.notes == []
+
+
+def test_stop_turns_off(fp):
+    buttons = [fp.controls.col1_select, fp.controls.col2_select]
+    fp.lights.meter(buttons[0], 1.0)
+    fp.lights.meter(buttons[1], 1.0)
+    fp.lights.render(0.0)
+    fp.notes.clear()
+    fp.lights.stop([buttons[0]])
+    assert [animation.buttons for animation in fp.lights.animations] == [[buttons[1]]]
+    # Top of the meter is red, only red is turned off
+    assert fp.notes == [(buttons[0].channel + 1, buttons[0].midi_id, 0)]
+    fp.lights.stop()
+    assert fp.lights.animations == []
+    assert fp.lights.sent == {}
+
+
+def test_failing_animation_is_dropped(fp):
+    button = fp.controls.col1_select
+    meter = fp.lights.meter(button, 0.5)
+    pulse = fp.lights.pulse([fp.controls.col2_select], (255, 0, 0))
+    meter.level = float('nan')
+    fp.lights.render(0.0)
+    assert fp.lights.animations == [pulse]
+    assert fp.controls.col2_select in fp.lights.sent
@@ -0,0 +1,155 @@
+import mido
+import pytest
+from Faderport.hooks import DispatchHook, DispatchHooks, ProfileHook, StatsHook
+from Faderport.structure import FaderportControls
+
+
+class StubFaderport:
+    def __init__(self, report_path: str = ""):
+        self.controls = FaderportControls()
+        self.called = []
+        # Plain controls have no callbacks, record calls instead
+        for midi_ids in self.controls.midi_triggers.values():
+            for midi_types in midi_ids.values():
+                for midi_type, entry in midi_types.items():
+                    midi_types[midi_type] = (entry[0], self.callback_midi)
+        for topics in self.controls.mqtt_topics_in.values():
+            for topic, entry in topics.items():
+                topics[topic] = (entry[0], self.callback_mqtt)
+        self.hooks = DispatchHooks(faderport=self, report_path=report_path)
+        self.controls.mqtt_topics_in[self.hooks.name] = {"set": (self.hooks, self.hooks.callback_set_parse_mqtt)}
+
+    def callback_midi(self, control_object, msg):
+        self.called.append((control_object.name, msg.type))
+
+    def callback_mqtt(self, topics, control_object, msg):
+        self.called.append((control_object.name, topics[2]))
+
+    def dispatch_midi(self, button, velocity: int = 127):
+        entry = self.controls.midi_triggers[button.channel][button.midi_id]["note_on"]
+        entry[1](entry[0], mido.Message("note_on", note=button.midi_id, velocity=velocity))
+
+
+class RaisingHook(DispatchHook):
+    def pre(self, control_object, kind: str, msg):
+        raise RuntimeError("pre")
+
+    def post(self, control_object, kind: str, msg, duration: float):
+        raise RuntimeError("post")
+
+
+class Payload:
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+
+def snapshot(controls: FaderportControls) -> list:
+    entries = []
+    for channel, midi_ids in controls.midi_triggers.items():
+        for midi_id, midi_types in midi_ids.items():
+            for midi_type, entry in midi_types.items():
+                entries.append((channel, midi_id, midi_type, entry))
+    for name, topics in controls.mqtt_topics_in.items():
+        for topic, entry in topics.items():
+            entries.append((name, topic, None, entry))
+    return entries
+
+
+def assert_same_entries(a: list, b: list):
+    assert len(a) == len(b)
+    for entry_a, entry_b in zip(a, b):
+        assert entry_a[:3] == entry_b[:3]
+        assert entry_a[3][0] is entry_b[3][0]
+        assert entry_a[3][1] == entry_b[3][1]
+
+
+def test_clear_restores_tables():
+    fp = StubFaderport()
+    original = snapshot(fp.controls)
+    fp.hooks.enable_stats()
+    hooked = snapshot(fp.controls)
+    assert any(a[3][1] != b[3][1] for a, b in zip(original, hooked))
+    fp.hooks.clear()
+    assert_same_entries(snapshot(fp.controls), original)
+
+
+def test_only_matching_entries_are_wrapped():
+    fp = StubFaderport()
+    original = snapshot(fp.controls)
+    fp.hooks.enable_stats(controls=["col1_select"], kinds=["note_on"])
+    wrapped = [a[:3] for a, b in zip(original, snapshot(fp.controls)) if a[3][1] != b[3][1]]
+    button = fp.controls.col1_select
+    assert wrapped == [(button.channel, button.midi_id, "note_on")]
+    fp.hooks.remove(fp.hooks.hooks[0])
+    assert_same_entries(snapshot(fp.controls), original)
+
+
+def test_profiling_topic_is_not_wrapped():
+    fp = StubFaderport()
+    fp.hooks.enable_stats()
+    assert fp.controls.mqtt_topics_in[fp.hooks.name]["set"][1] == fp.hooks.callback_set_parse_mqtt
+
+
+def test_replace_by_name():
+    fp = StubFaderport()
+    first = fp.hooks.enable_stats()
+    second = fp.hooks.enable_stats()
+    fp.hooks.enable_profile()
+    fp.hooks.enable_profile()
+    assert [type(hook) for hook in fp.hooks.hooks] == [StatsHook, ProfileHook]
+    assert fp.hooks.hooks[0] is second
+    assert first.writer is None
+    fp.dispatch_midi(fp.controls.col1_select)
+    assert second.counts[("col1_select", "note_on")][0] == 1
+    assert first.counts == {}
+
+
+def test_stats_counts_midi_and_mqtt():
+    fp = StubFaderport()
+    stats = fp.hooks.enable_stats()
+    for velocity in (127, 0):
+        fp.dispatch_midi(fp.controls.col1_select, velocity)
+    entry = fp.controls.mqtt_topics_in["col1_select"]["set_light"]
+    entry[1](["faderport", "col1_select", "set_light"], entry[0], Payload(b"Lit"))
+    assert fp.called == [("col1_select", "note_on"), ("col1_select", "note_on"), ("col1_select", "set_light")]
+    assert stats.counts[("col1_select", "note_on")][0] == 2
+    assert stats.counts[("col1_select", "set_light")][0] == 1
+    report = stats.report()
+    assert "col1_select" in report
+    assert "Slowest callbacks" in report
+
+
+def test_raising_hook_doesnt_stop_callback():
+    fp = StubFaderport()
+    stats = fp.hooks.enable_stats()
+    fp.hooks.add(RaisingHook(name="raising"))
+    fp.dispatch_midi(fp.controls.col1_select)
+    assert fp.called == [("col1_select", "note_on")]
+    assert stats.counts[("col1_select", "note_on")][0] == 1
+
+
+def test_callback_errors_still_run_post():
+    fp = StubFaderport()
+    button = fp.controls.col1_select
+
+    def failing(control_object, msg):
+        raise RuntimeError("callback")
+    fp.controls.midi_triggers[button.channel][button.midi_id]["note_on"] = (button, failing)
+    stats = fp.hooks.enable_stats()
+    with pytest.raises(RuntimeError):
+        fp.dispatch_midi(button)
+    assert stats.counts[("col1_select", "note_on")][0] == 1
+
+
+def test_mqtt_commands_and_report(tmp_path):
+    path = tmp_path / "profiling.txt"
+    fp = StubFaderport(report_path=str(path))
+    callback = fp.controls.mqtt_topics_in[fp.hooks.name]["set"][1]
+    topics = ["faderport", "profiling", "set"]
+    callback(topics, fp.hooks, Payload(b"stats"))
+    callback(topics, fp.hooks, Payload(b"stats"))
+    assert len(fp.hooks.hooks) == 1
+    callback(topics, fp.hooks, Payload(b"report"))
+    assert "stats" in path.read_text()
+    callback(topics, fp.hooks, Payload(b"off"))
+    assert fp.hooks.hooks == []
@@ -0,0 +1,121 @@
+import json
+import pytest
+from Faderport.constants import SYSEX_PREFIX_FADERPORT
+from Faderport.identity import DeviceIdentity, IdentityCache
+
+# Identity Reply of a Faderport 8 without F0 and F7: PreSonus, family 0x02, member 0x00, version 1.2.3.4
+REPLY_FP8 = [0x7E, 0x00, 0x06, 0x02, 0x00, 0x01, 0x06, 0x02, 0x00, 0x00, 0x00, 0x01, 0x02, 0x03, 0x04]
+REPLY_FP16 = [0x7E, 0x00, 0x06, 0x02, 0x00, 0x01, 0x06, 0x16, 0x00, 0x00, 0x00, 0x01, 0x02, 0x03, 0x04]
+# 1-byte manufacturer ID (0x41), family 0x0102, member 0x0003
+REPLY_ONE_BYTE = [0x7E, 0x10, 0x06, 0x02, 0x41, 0x02, 0x01, 0x03, 0x00, 0x00, 0x00, 0x00, 0x01]
+
+
+def test_from_sysex_three_byte_manufacturer():
+    identity = DeviceIdentity.from_sysex(REPLY_FP8)
+    assert identity.manufacturer == [0x00, 0x01, 0x06]
+    assert identity.family == 0x02
+    assert identity.member == 0x00
+    assert identity.version == [1, 2, 3, 4]
+    assert identity.firmware == "1.2.3.4"
+
+
+def test_from_sysex_one_byte_manufacturer():
+    identity = DeviceIdentity.from_sysex(REPLY_ONE_BYTE)
+    assert identity.manufacturer == [0x41]
+    assert identity.family == 0x02 | 0x01 << 7
+    assert identity.member == 0x03
+    assert identity.version == [0, 0, 0, 1]
+
+
+@pytest.mark.parametrize("data", [
+    [],
+    [0x7E, 0x00, 0x06],
+    # Identity Request, not a reply
+    [0x7E, 0x7F, 0x06, 0x01],
+    # Not a universal non-realtime message
+    [0x7F, 0x00, 0x06, 0x02] + REPLY_FP8[4:],
+    # Short replies
+    REPLY_FP8[:-1],
+    REPLY_ONE_BYTE[:-1],
+])
+def test_from_sysex_rejects(data):
+    assert DeviceIdentity.from_sysex(data) is None
+
+
+def test_model_and_sysex_prefix():
+    fp8 = DeviceIdentity.from_sysex(REPLY_FP8)
+    assert fp8.model == "FP8"
+    assert fp8.sysex_prefix == SYSEX_PREFIX_FADERPORT
+    fp16 = DeviceIdentity.from_sysex(REPLY_FP16)
+    assert fp16.model == "FP16"
+    assert fp16.sysex_prefix == [0x00, 0x01, 0x06, 0x16]
+
+
+def test_unknown_model_uses_faderport_prefix():
+    other = DeviceIdentity.from_sysex(REPLY_ONE_BYTE)
+    assert other.model == ""
+    assert other.sysex_prefix == SYSEX_PREFIX_FADERPORT
+    unknown_family = DeviceIdentity(manufacturer=[0x00, 0x01, 0x06], family=0x7F, member=0, version=[0, 0, 0, 0])
+    assert unknown_family.model == ""
+
+
+def test_dict_round_trip():
+    identity = DeviceIdentity.from_sysex(REPLY_FP16)
+    copy = DeviceIdentity.from_dict(identity.to_dict())
+    assert copy.to_dict() == identity.to_dict()
+    assert copy.model == "FP16"
+
+
+def test_cache_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "identity.json")
+    cache = IdentityCache(path=path)
+    cache.set_port("in", "PreSonus FP8 Port 1")
+    cache.set_identity("PreSonus FP8 Port 1", DeviceIdentity.from_sysex(REPLY_FP8))
+    cache = IdentityCache(path=path)
+    assert cache.get_port("in") == "PreSonus FP8 Port 1"
+    assert cache.get_port("out") == ""
+    assert cache.is_probed("PreSonus FP8 Port 1")
+    assert cache.get_identity("PreSonus FP8 Port 1").model == "FP8"
+    assert cache.get_identity("Other") is None
+    cache.forget_ports()
+    assert IdentityCache(path=path).get_port("in") == ""
+
+
+def test_cache_no_identity(tmp_path):
+    path = str(tmp_path / "identity.json")
+    cache = IdentityCache(path=path)
+    assert not cache.is_probed("Port 1")
+    cache.set_no_identity("Port 1")
+    cache = IdentityCache(path=path)
+    assert cache.is_probed("Port 1")
+    assert cache.get_identity("Port 1") is None
+    # A later reply replaces the negative result
+    cache.set_identity("Port 1", DeviceIdentity.from_sysex(REPLY_FP8))
+    assert IdentityCache(path=path).get_identity("Port 1").model == "FP8"
+
+
+@pytest.mark.parametrize("content", ["{", "not json", ""])
+def test_cache_broken_file_is_a_miss(tmp_path, content):
+    path = tmp_path / "identity.json"
+    path.write_text(content)
+    cache = IdentityCache(path=str(path))
+    assert cache.ports == {}
+    assert cache.identities == {}
+    cache.set_port("in", "Port 1")
+    assert json.loads(path.read_text())["ports"] == {"in": "Port 1"}
+
+
+def test_cache_broken_entry_is_a_miss(tmp_path):
+    path = tmp_path / "identity.json"
+    path.write_text(json.dumps({"ports": {}, "identities": {"Port 1": {"family": 2}}}))
+    cache = IdentityCache(path=str(path))
+    assert cache.is_probed("Port 1")
+    assert cache.get_identity("Port 1") is None
+
+
+def test_cache_disabled():
+    cache = IdentityCache(path="")
+    cache.set_port("in", "Port 1")
+    cache.set_no_identity("Port 1")
+    assert cache.get_port("in") == "Port 1"
+    assert cache.is_probed("Port 1")
@@ -0,0 +1,151 @@
+import mido
+import pytest
+from Faderport.constants import ColorsSingle
+from Faderport.rules import FeedbackRules
+from Faderport.structure import Button, FaderportControls
+
+LIT = ColorsSingle.Lit.value
+BLACK = ColorsSingle.Black.value
+
+
+class StubEvents:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, control, kind: str, value):
+        self.published.append((control.name, kind, value))
+
+
+class StubFaderport:
+    def __init__(self, rules: list = None, test_mode: bool = False):
+        self.controls = None
+        self.events = StubEvents()
+        self.lights_set = []
+        self.rules = FeedbackRules(faderport=self, test_mode=test_mode)
+        self.controls = FaderportControls()
+        for element in self.controls.elements:
+            if type(element) is Button:
+                element.callback_set_light = self.button_set_color
+        if rules is not None:
+            self.rules.set_rules(rules)
+        self.rules.compile()
+
+    def button_set_color(self, button: Button, color_to_set):
+        self.rules.sync(button, color_to_set)
+        self.lights_set.append((button.name, color_to_set))
+
+    def press(self, name: str):
+        self.reflex(name, mido.Message("note_on", note=0, velocity=127))
+
+    def release(self, name: str):
+        self.reflex(name, mido.Message("note_on", note=0, velocity=0))
+
+    def reflex(self, name: str, msg):
+        self.rules.reflexes[getattr(self.controls, name)](msg)
+
+
+def test_momentary():
+    fp = StubFaderport([{"type": "momentary", "controls": ["col1_mute"]}])
+    fp.press("col1_mute")
+    fp.release("col1_mute")
+    assert fp.lights_set == [("col1_mute", LIT), ("col1_mute", BLACK)]
+    assert fp.events.published == []
+
+
+def test_momentary_rgb_color():
+    fp = StubFaderport([{"type": "momentary", "controls": ["col1_select"], "color": "255,0,0"}])
+    fp.press("col1_select")
+    fp.release("col1_select")
+    assert fp.lights_set == [("col1_select", (255, 0, 0)), ("col1_select", BLACK)]
+
+
+def test_toggle():
+    fp = StubFaderport([{"type": "toggle", "controls": ["col1_mute"], "color": "LitBlink"}])
+    fp.press("col1_mute")
+    fp.release("col1_mute")
+    fp.press("col1_mute")
+    assert fp.lights_set == [("col1_mute", ColorsSingle.LitBlink.value), ("col1_mute", BLACK)]
+    assert fp.events.published == [("col1_mute", "state", 1), ("col1_mute", "state", 0)]
+
+
+def test_toggle_follows_external_light():
+    fp = StubFaderport([{"type": "toggle", "controls": ["col1_mute"]}])
+    fp.press("col1_mute")
+    fp.controls.col1_mute.set_light("Black")
+    fp.press("col1_mute")
+    assert fp.lights_set[-1] == ("col1_mute", LIT)
+    assert fp.events.published[-1] == ("col1_mute", "state", 1)
+
+
+def test_radio_exclusive():
+    fp = StubFaderport([{"type": "radio", "controls": ["col1_solo", "col2_solo", "col3_solo"]}])
+    fp.press("col1_solo")
+    fp.press("col2_solo")
+    assert fp.rules.state == {"col1_solo": False, "col2_solo": True}
+    assert fp.lights_set == [("col1_solo", LIT), ("col1_solo", BLACK), ("col2_solo", LIT)]
+    # Pressing the lit button turns it off
+    fp.press("col2_solo")
+    assert fp.rules.state["col2_solo"] is False
+    assert fp.events.published == [("col1_solo", "state", 1), ("col1_solo", "state", 0), ("col2_solo", "state", 1),
+                                   ("col2_solo", "state", 0)]
+
+
+def test_follow_touch():
+    fp = StubFaderport([{"type": "follow", "source": "col1_slider", "target": "col1_select", "color": "Lit"}])
+    fp.press("col1_slider")
+    fp.reflex("col1_slider", mido.Message("note_off", note=0))
+    assert fp.lights_set == [("col1_select", LIT), ("col1_select", BLACK)]
+    # Pitch messages aren't touch or release
+    fp.reflex("col1_slider", mido.Message("pitchwheel", pitch=100))
+    assert len(fp.lights_set) == 2
+
+
+def test_test_mode_lights_all_buttons():
+    fp = StubFaderport(test_mode=True)
+    buttons = [element for element in fp.controls.elements if type(element) is Button]
+    assert set(fp.rules.reflexes) == set(buttons)
+    fp.press("left_arm")
+    assert fp.lights_set == [("left_arm", LIT)]
+
+
+def test_test_mode_comes_first():
+    fp = StubFaderport([{"type": "toggle", "controls": ["col1_mute"], "color": "LitBlink"}], test_mode=True)
+    fp.press("col1_mute")
+    assert fp.lights_set == [("col1_mute", LIT), ("col1_mute", ColorsSingle.LitBlink.value)]
+
+
+def test_rules_under_key():
+    fp = StubFaderport({"rules": [{"type": "momentary", "controls": ["col1_mute"]}]})
+    assert list(fp.rules.reflexes) == [fp.controls.col1_mute]
+
+
+@pytest.mark.parametrize("rules", [
+    {"rules": "momentary"},
+    [{"type": "blink", "controls": ["col1_mute"]}],
+    ["momentary"],
+    [{"type": "momentary", "controls": ["col1_mutee"]}],
+    [{"type": "momentary", "controls": "col1_mute"}],
+    [{"type": "momentary", "controls": ["col1_slider"]}],
+    [{"type": "follow", "source": "col1_slider", "target": "col1_slider"}],
+    [{"type": "follow", "source": "col9_slider", "target": "col1_select"}],
+    [{"type": "momentary", "controls": ["col1_mute"], "color": "Purple"}],
+    [{"type": "momentary", "controls": ["col1_mute"], "color": "255,0,0"}],
+    [{"type": "momentary", "controls": ["col1_mute"], "color": 99}],
+    [{"type": "momentary", "controls": ["col1_select"], "color": "255,0,256"}],
+])
+def test_validation_errors(rules):
+    fp = StubFaderport([{"type": "momentary", "controls": ["col2_mute"]}])
+    with pytest.raises(Exception):
+        fp.rules.set_rules(rules)
+    # Rules in use are kept
+    assert list(fp.rules.reflexes) == [fp.controls.col2_mute]
+
+
+def test_validated_before_controls_exist():
+    class NoControls:
+        controls = None
+    rules = FeedbackRules(faderport=NoControls())
+    with pytest.raises(Exception):
+        rules.set_rules([{"type": "toggle", "controls": ["col1_mutee"]}])
+    rules.set_rules([{"type": "toggle", "controls": ["col1_mute"]}])
+    assert rules.reflexes == {}
@@ -0,0 +1,90 @@
+import pytest
+from Faderport.structure import PitchWheel
+from Faderport.taper import FaderTaperAudio, PITCH_MAX, PITCH_MIN
+
+
+class StubSender:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, channel: int, pitch_value: int):
+        self.sent.append(pitch_value)
+
+
+@pytest.fixture
+def slider():
+    slider = PitchWheel(name="col1_slider", cb_pitchwheel_set_pitch=StubSender(), channel=0, touch_id=104,
+                        taper=FaderTaperAudio())
+    return slider
+
+
+def test_set_pitch_sends_changes_only(slider):
+    slider.set_pitch(100)
+    slider.set_pitch(100)
+    slider.set_pitch("200")
+    slider.set_pitch(b"-300")
+    assert slider.callback_pitchwheel_set_pitch.sent == [100, 200, -300]
+    assert slider.pitch == -300
+
+
+@pytest.mark.parametrize("pitch", [PITCH_MIN - 1, PITCH_MAX + 1, "up", 1.5, None])
+def test_set_pitch_validation(slider, pitch):
+    with pytest.raises(Exception):
+        slider.set_pitch(pitch)
+    assert slider.callback_pitchwheel_set_pitch.sent == []
+
+
+def test_deferred_while_touched(slider):
+    slider.set_pitch(0)
+    slider.set_touched(True)
+    for pitch in (100, 200, 200, 300):
+        slider.set_pitch(pitch)
+    assert slider.callback_pitchwheel_set_pitch.sent == [0]
+    assert slider.deferred_pitch == 300
+    slider.set_touched(False)
+    assert slider.callback_pitchwheel_set_pitch.sent == [0, 300]
+    assert slider.pitch == 300
+    assert slider.deferred_pitch is None
+    assert slider.sends_suppressed == 3
+    assert slider.sends_deferred == 1
+    assert slider.sends_avoided == 2
+
+
+def test_deferred_equal_to_released_position(slider):
+    slider.set_pitch(0)
+    slider.set_touched(True)
+    # User moves the fader, reported by the Faderport
+    slider.pitch = 500
+    slider.set_pitch(500)
+    slider.set_touched(False)
+    assert slider.callback_pitchwheel_set_pitch.sent == [0]
+    assert slider.sends_suppressed == 0
+    assert slider.sends_deferred == 0
+
+
+def test_deferred_back_to_current_pitch(slider):
+    slider.set_pitch(0)
+    slider.set_touched(True)
+    slider.set_pitch(100)
+    slider.set_pitch(0)
+    slider.set_touched(False)
+    assert slider.callback_pitchwheel_set_pitch.sent == [0]
+    assert slider.sends_suppressed == 2
+    assert slider.sends_deferred == 0
+    assert slider.sends_avoided == 2
+
+
+def test_release_without_deferred_pitch(slider):
+    slider.set_touched(True)
+    slider.set_touched(False)
+    slider.set_pitch(100)
+    assert slider.callback_pitchwheel_set_pitch.sent == [100]
+
+
+def test_set_normalized_and_db(slider):
+    slider.set_normalized("1.0")
+    assert slider.callback_pitchwheel_set_pitch.sent == [PITCH_MAX]
+    slider.set_db(b"-100")
+    assert slider.callback_pitchwheel_set_pitch.sent == [PITCH_MAX, PITCH_MIN]
+    with pytest.raises(Exception):
+        slider.set_normalized("nan")
@@ -0,0 +1,119 @@
+import pytest
+from Faderport.taper import FaderTaperAudio, FaderTaperBreakpoints, FaderTaperLinear, PITCH_MAX, PITCH_MIN, \
+    PITCH_STEPS
+
+TAPER_CLASSES = [FaderTaperLinear, FaderTaperAudio]
+
+
+@pytest.mark.parametrize("taper_class", TAPER_CLASSES)
+def test_compile_tables(taper_class):
+    taper = taper_class()
+    assert len(taper.pitch_to_normalized_table) == PITCH_STEPS
+    assert len(taper.pitch_to_db_table) == PITCH_STEPS
+    assert len(taper.pitch_to_normalized_payload) == PITCH_STEPS
+    assert len(taper.pitch_to_db_payload) == PITCH_STEPS
+    assert taper.pitch_to_normalized(PITCH_MIN) == 0.0
+    assert taper.pitch_to_db(PITCH_MIN) == float('-inf')
+    assert taper.pitch_to_normalized(PITCH_MAX) == pytest.approx(1.0)
+    assert taper.pitch_to_db(PITCH_MAX) == pytest.approx(taper.max_db)
+    assert taper.pitch_to_normalized_payload[-1] == "1.0000"
+    assert taper.pitch_to_db_payload[-1] == "10.00"
+
+
+def test_linear_taper_is_off_below_min_db():
+    taper = FaderTaperLinear(min_db=-60.0, max_db=10.0)
+    published = [float(payload) for payload in taper.pitch_to_db_payload if payload != "-inf"]
+    assert min(published) >= -60.0
+    # Echoing the lowest published level doesn't snap the fader to the bottom
+    lowest = min(pitch for pitch in range(PITCH_MIN, PITCH_MAX + 1) if taper.pitch_to_db(pitch) != float('-inf'))
+    assert taper.db_to_pitch(float(taper.pitch_to_db_payload[lowest - PITCH_MIN])) == lowest
+
+
+def test_audio_taper_is_linear_in_db():
+    taper = FaderTaperAudio(min_db=-60.0, max_db=10.0)
+    assert taper.pitch_to_db(0) == pytest.approx(-60.0 + 8192 / 16383 * 70.0)
+
+
+@pytest.mark.parametrize("taper_class", TAPER_CLASSES)
+def test_normalized_round_trip(taper_class):
+    taper = taper_class()
+    for pitch in range(PITCH_MIN, PITCH_MAX + 1, 7):
+        assert taper.normalized_to_pitch(taper.pitch_to_normalized(pitch)) == pitch
+
+
+@pytest.mark.parametrize("taper_class", TAPER_CLASSES)
+def test_db_round_trip(taper_class):
+    taper = taper_class()
+    for pitch in range(PITCH_MIN, PITCH_MAX + 1, 7):
+        db = taper.pitch_to_db(pitch)
+        assert db == float('-inf') or db >= taper.min_db
+        if db == float('-inf'):
+            # Off sets the fader to the bottom
+            assert taper.db_to_pitch(db) == PITCH_MIN
+        else:
+            assert taper.db_to_pitch(db) == pitch
+
+
+def test_normalized_low_values_are_resolved():
+    taper = FaderTaperAudio()
+    low = taper.normalized_to_pitch(0.0001)
+    high = taper.normalized_to_pitch(0.0003)
+    assert low != high
+    assert low < high
+
+
+def test_normalized_to_pitch_picks_nearest():
+    taper = FaderTaperLinear()
+    a = taper.pitch_to_normalized(100)
+    b = taper.pitch_to_normalized(101)
+    assert taper.normalized_to_pitch(a + (b - a) * 0.4) == 100
+    assert taper.normalized_to_pitch(a + (b - a) * 0.6) == 101
+
+
+def test_clamping():
+    taper = FaderTaperAudio()
+    assert taper.normalized_to_pitch(-1.0) == PITCH_MIN
+    assert taper.normalized_to_pitch(2.0) == PITCH_MAX
+    assert taper.db_to_pitch(-100.0) == PITCH_MIN
+    assert taper.db_to_pitch(float('-inf')) == PITCH_MIN
+    assert taper.db_to_pitch(20.0) == PITCH_MAX
+
+
+def test_breakpoints_interpolate():
+    taper = FaderTaperBreakpoints([(0.0, -60.0), (0.5, 0.0), (1.0, 10.0)])
+    assert taper.min_db == -60.0
+    assert taper.max_db == 10.0
+    assert taper.position_to_db(0.25) == pytest.approx(-30.0)
+    assert taper.position_to_db(0.75) == pytest.approx(5.0)
+
+
+def test_breakpoints_off_segment():
+    taper = FaderTaperBreakpoints([(0.0, float('-inf')), (0.25, -40.0), (0.75, 0.0), (1.0, 10.0)])
+    assert taper.min_db == -40.0
+    # Off until the next breakpoint
+    assert taper.position_to_db(0.0) == float('-inf')
+    assert taper.position_to_db(0.2) == float('-inf')
+    assert taper.position_to_db(0.25) == -40.0
+    off_pitches = [pitch for pitch in range(PITCH_MIN, PITCH_MAX + 1) if taper.pitch_to_db(pitch) == float('-inf')]
+    assert off_pitches == list(range(PITCH_MIN, off_pitches[-1] + 1))
+    assert taper.pitch_to_normalized(off_pitches[-1]) == 0.0
+    assert taper.normalized_to_pitch(0.0) == PITCH_MIN
+    assert taper.db_to_pitch(-40.0) == off_pitches[-1] + 1
+
+
+@pytest.mark.parametrize("breakpoints", [
+    [(0.0, -60.0)],
+    [(0.1, -60.0), (1.0, 10.0)],
+    [(0.0, -60.0), (0.9, 0.0)],
+    [(0.0, -60.0), (0.5, -10.0), (0.5, 0.0), (1.0, 10.0)],
+    [(0.0, float('-inf')), (1.0, 10.0)],
+    [(0.0, -60.0), (0.5, 0.0), (1.0, -10.0)],
+])
+def test_breakpoints_validation(breakpoints):
+    with pytest.raises(Exception):
+        FaderTaperBreakpoints(breakpoints)
+
+
+def test_min_db_must_be_below_max_db():
+    with pytest.raises(Exception):
+        FaderTaperAudio(min_db=10.0, max_db=10.0)
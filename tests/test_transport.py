@@ -0,0 +1,144 @@
+import socket
+import threading
+import time
+import pytest
+from Faderport.transport import LocalClient, LocalTransport, LOCAL_MATCHES_SIZE, LOCAL_QUEUE_SIZE, topic_matches, \
+    _FRAME_PUBLISH, _FRAME_SUBSCRIBE, _LocalConnection, _pack_frame
+
+
+@pytest.mark.parametrize("subscription, topic, expected", [
+    ("faderport/col1_select/event/down", "faderport/col1_select/event/down", True),
+    ("faderport/col1_select/event/down", "faderport/col1_select/event/up", False),
+    ("#", "faderport/col1_select/event/down", True),
+    ("#", "faderport", True),
+    ("faderport/#", "faderport/col1_select/event/down", True),
+    ("faderport/#", "faderport", True),
+    ("faderport/#", "other/col1_select", False),
+    ("faderport/+/event/down", "faderport/col1_select/event/down", True),
+    ("faderport/+/event/down", "faderport/col1_select/event/up", False),
+    ("faderport/+", "faderport/col1_select/event/down", False),
+    ("faderport/+/+/+", "faderport/col1_select/event/down", True),
+    ("+", "faderport", True),
+    ("+", "faderport/col1_select", False),
+    ("faderport/+/event/down/more", "faderport/col1_select/event/down", False),
+    ("faderport/col1_select", "faderport/col1_select/event/down", False),
+    ("faderport/+/#", "faderport/col1_select", True),
+])
+def test_topic_matches(subscription, topic, expected):
+    assert topic_matches(subscription, topic) is expected
+
+
+@pytest.mark.parametrize("topic, payload, expected", [
+    ("faderport/col1_select/event/down", b"127", b"127"),
+    ("faderport/col1_slider/set_db", "-6.5", b"-6.5"),
+    ("faderport/rules/set", b"", b""),
+    ("faderport/display/å", "äö", "äö".encode()),
+])
+def test_frame_pack_unpack(topic, payload, expected):
+    a, b = socket.socketpair()
+    try:
+        sender = _LocalConnection(a)
+        receiver = _LocalConnection(b)
+        sender.send(_pack_frame(_FRAME_PUBLISH, topic, payload))
+        sender.send_frame(_FRAME_SUBSCRIBE, topic)
+        assert receiver.receive_frame() == (_FRAME_PUBLISH, topic, expected)
+        assert receiver.receive_frame() == (_FRAME_SUBSCRIBE, topic, b"")
+        sender.close()
+        assert receiver.receive_frame() is None
+    finally:
+        a.close()
+        b.close()
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def transport(tmp_path):
+    transport = LocalTransport(path=str(tmp_path / "faderport.sock"))
+    received = []
+    transport.on_message = lambda client, userdata, msg: received.append((msg.topic, msg.payload))
+    transport.received = received
+    transport.subscribe("faderport/+/set_light")
+    transport.start()
+    yield transport
+    transport.stop()
+
+
+def connect_client(transport, subscription: str):
+    client = LocalClient()
+    received = []
+    client.on_message = lambda c, userdata, msg: received.append((msg.topic, msg.payload))
+    client.received = received
+    client.connect(transport.path)
+    client.subscribe(subscription)
+    client.loop_start()
+    assert wait_for(lambda: any(subscription in connection.subscriptions for connection in transport.connections))
+    return client
+
+
+def test_local_round_trip(transport):
+    client = connect_client(transport, "faderport/+/event/#")
+    try:
+        transport.publish("faderport/col1_select/event/down", "127")
+        transport.publish("faderport/col1_select/set_light", "1")
+        assert wait_for(lambda: client.received)
+        assert client.received == [("faderport/col1_select/event/down", b"127")]
+        client.publish("faderport/col1_select/set_light", "Lit")
+        client.publish("faderport/col1_select/set_other", "1")
+        assert wait_for(lambda: transport.received)
+        time.sleep(0.05)
+        assert transport.received == [("faderport/col1_select/set_light", b"Lit")]
+    finally:
+        client.loop_stop()
+
+
+def test_local_forwards_between_clients(transport):
+    listener = connect_client(transport, "faderport/#")
+    sender = connect_client(transport, "other/#")
+    try:
+        sender.publish("faderport/col1_select/set_light", "Lit")
+        assert wait_for(lambda: listener.received)
+        assert listener.received == [("faderport/col1_select/set_light", b"Lit")]
+        assert wait_for(lambda: transport.received)
+    finally:
+        listener.loop_stop()
+        sender.loop_stop()
+
+
+def test_local_slow_consumer_doesnt_block_publish(transport):
+    # Subscribe and never read
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(transport.path)
+    sock.sendall(_pack_frame(_FRAME_SUBSCRIBE, "#", b""))
+    assert wait_for(lambda: transport.connections and transport.connections[0].subscriptions)
+    try:
+        done = threading.Event()
+
+        def publish():
+            for i in range(LOCAL_QUEUE_SIZE * 20):
+                transport.publish("faderport/col1_slider/event/pitch", "x" * 1000)
+            done.set()
+        threading.Thread(target=publish, daemon=True).start()
+        assert done.wait(timeout=5.0)
+        assert transport.connections == []
+    finally:
+        sock.close()
+
+
+def test_local_matches_cache_is_bounded(transport):
+    client = connect_client(transport, "faderport/#")
+    try:
+        for i in range(LOCAL_MATCHES_SIZE * 2 + 10):
+            client.publish(f"other/{i}", "1")
+        client.publish("faderport/done", "1")
+        assert wait_for(lambda: client.received)
+        assert 0 < len(transport._matches) <= LOCAL_MATCHES_SIZE
+    finally:
+        client.loop_stop()